@@ -0,0 +1,275 @@
+import math
+import operator
+import pickle
+import tempfile
+from functools import partial
+from itertools import chain, islice
+from column_store import convert_value
+from filter_engine import build_leaf, compile_condition, compile_tree, condition_columns, filter_rows, uses_index
+from metrics import METRICS, plan_step
+from parallel import parallel_plan
+from sql_parser import ColumnRef, Comparison
+from workspace import take
+
+GROUP_MEMORY_LIMIT = 100000
+SPILL_PARTITIONS = 16
+BATCH_SIZE = 65536
+
+
+def _average(values):
+    return sum(values), len(values)
+
+
+def _merge_average(a, b):
+    return a[0] + b[0], a[1] + b[1]
+
+
+def _final_average(state):
+    return state[0] / state[1] if state[1] else None
+
+
+def _exact_sum(values):
+    # Floats whose exact sum is that of values, each one the fsum of what the
+    # ones before it left over: their fsum is the correctly rounded total
+    # however the rows were split into batches and workers.
+    if len(values) == 1:
+        return list(values)
+    partials = []
+    try:
+        total = math.fsum(values)
+        while total and math.isfinite(total):
+            partials.append(total)
+            total = math.fsum(chain(values, [-p for p in partials]))
+    except OverflowError:
+        return [sum(values)]
+    return partials if not total else [total]
+
+
+def _merge_exact(a, b):
+    return _exact_sum(a + b)
+
+
+def _exact_average(values):
+    return _exact_sum(values), len(values)
+
+
+def _merge_exact_average(a, b):
+    return _merge_exact(a[0], b[0]), a[1] + b[1]
+
+
+def _final_exact_average(state):
+    return math.fsum(state[0]) / state[1] if state[1] else None
+
+
+# batch(values) -> partial state, merge(state, state) -> state, final(state) -> value
+FUNCTIONS = {
+    "COUNT": (len, operator.add, None),
+    "SUM": (sum, operator.add, None),
+    "MIN": (min, min, None),
+    "MAX": (max, max, None),
+    "AVG": (_average, _merge_average, _final_average),
+}
+
+# FLOAT sums are kept exact, so serial and parallel plans give the same answer.
+FLOAT_FUNCTIONS = {
+    "SUM": (_exact_sum, _merge_exact, math.fsum),
+    "AVG": (_exact_average, _merge_exact_average, _final_exact_average),
+}
+
+
+class HashAggregator:
+    # Groups rows a batch at a time: positions are bucketed by group key and
+    # each aggregate folds a whole bucket with a builtin (len, sum, min, max).
+    # Past max_groups the partial states are spilled to hash partitions on
+    # disk and merged one partition at a time at the end.
+    def __init__(self, aggregates, column_types, max_groups=GROUP_MEMORY_LIMIT):
+        self.functions = [FLOAT_FUNCTIONS[agg.function]
+                          if agg.function in FLOAT_FUNCTIONS and column_types.get(agg.column) == "FLOAT"
+                          else FUNCTIONS[agg.function] for agg in aggregates]
+        self.max_groups = max_groups
+        self.groups = {}
+        self.partitions = None
+
+    def add_batch(self, keys, columns):
+        if keys is None:
+            partial = [batch(values) for (batch, _, _), values in zip(self.functions, columns)]
+            state = self.groups.get(())
+            self.groups[()] = partial if state is None else self._merge(state, partial)
+            return
+        buckets = {}
+        for pos, key in enumerate(keys):
+            buckets.setdefault(key, []).append(pos)
+        groups = self.groups
+        for key, positions in buckets.items():
+            partial = [batch(take(values, positions)) for (batch, _, _), values in zip(self.functions, columns)]
+            state = groups.get(key)
+            groups[key] = partial if state is None else self._merge(state, partial)
+        if len(groups) > self.max_groups:
+            self._spill()
+
+    def add_states(self, states):
+        groups = self.groups
+        for key, state in states:
+            existing = groups.get(key)
+            groups[key] = state if existing is None else self._merge(existing, state)
+        if len(groups) > self.max_groups:
+            self._spill()
+
+    def _merge(self, a, b):
+        return [merge(x, y) for (_, merge, _), x, y in zip(self.functions, a, b)]
+
+    def _spill(self):
+        METRICS.add("aggregate.spills")
+        if self.partitions is None:
+            self.partitions = [tempfile.TemporaryFile() for _ in range(SPILL_PARTITIONS)]
+        buckets = [[] for _ in self.partitions]
+        for item in self.groups.items():
+            buckets[hash(item[0]) % SPILL_PARTITIONS].append(item)
+        for f, bucket in zip(self.partitions, buckets):
+            if bucket:
+                pickle.dump(bucket, f)
+        self.groups = {}
+
+    def _final(self, state):
+        return [final(value) if final else value for (_, _, final), value in zip(self.functions, state)]
+
+    def results(self):
+        for key, state in self.states():
+            yield key, self._final(state)
+
+    def states(self):
+        if self.partitions is None:
+            yield from self.groups.items()
+            return
+        self._spill()
+        for f in self.partitions:
+            f.seek(0)
+            merged = {}
+            while True:
+                try:
+                    bucket = pickle.load(f)
+                except EOFError:
+                    break
+                for key, state in bucket:
+                    existing = merged.get(key)
+                    merged[key] = state if existing is None else self._merge(existing, state)
+            f.close()
+            yield from merged.items()
+
+
+def _metadata_value(ws, aggregate):
+    # COUNT(*) comes from the row count, MIN/MAX from the ends of a sorted index.
+    if aggregate.function == "COUNT":
+        return True, ws.row_count()
+    if aggregate.function not in ("MIN", "MAX") or ws.has_changes():
+        return False, None
+    index = ws.indexes.get_sorted(aggregate.column)
+    if index is None:
+        return False, None
+    rids = index.range(reverse=aggregate.function == "MAX")
+    rid = next((rid for rid in rids if rid < ws.base_rows), None)
+    return True, None if rid is None else ws.get(aggregate.column, rid)
+
+
+def column_types(ws):
+    return {col: column.type for col, column in ws.base.items()}
+
+
+def add_rows(aggregator, ws, rids, group_by, aggregates):
+    rids = iter(rids)
+    while True:
+        batch = list(islice(rids, BATCH_SIZE))
+        if not batch:
+            break
+        keys = list(zip(*[ws.values(col, batch) for col in group_by])) if group_by else None
+        columns = [batch if agg.column is None else ws.values(agg.column, batch) for agg in aggregates]
+        aggregator.add_batch(keys, columns)
+
+
+def aggregate_rows(ws, condition, group_by, aggregates, max_groups=GROUP_MEMORY_LIMIT):
+    for agg in aggregates:
+        if agg.column is not None and agg.column not in ws.columns:
+            raise ValueError(f"Column '{agg.column}' does not exist.")
+        if agg.function in ("SUM", "AVG") and ws.base[agg.column].type == "TEXT":
+            raise ValueError(f"{agg.function} requires a numeric column.")
+    labels = ", ".join(agg.label for agg in aggregates)
+    if condition is None and not group_by:
+        known = [_metadata_value(ws, agg) for agg in aggregates]
+        if all(found for found, _ in known):
+            plan_step("Aggregate", f"{labels} from metadata").rows = 1
+            return [((), [value for _, value in known])]
+    detail = f"{labels} group by {', '.join(group_by)}" if group_by else labels
+    if condition is None or not uses_index(ws, compile_condition(condition, ws)):
+        results = _parallel_aggregate(ws, condition, group_by, aggregates, max_groups, detail)
+        if results is not None:
+            return results
+    rids = filter_rows(ws, condition) if condition else ws.row_ids()
+    METRICS.add("rows.scanned", len(rids))
+    with plan_step("Hash Aggregate", detail) as op:
+        aggregator = HashAggregator(aggregates, column_types(ws), max_groups)
+        add_rows(aggregator, ws, rids, group_by, aggregates)
+        results = _results(aggregator, group_by, aggregates, op, detail)
+    return results
+
+
+def _parallel_aggregate(ws, condition, group_by, aggregates, max_groups, detail):
+    # Each worker filters and aggregates its own rows of the table file; the
+    # partial states are merged here in row order.
+    if ws.has_changes() or ws.tombstones:
+        return None
+    columns = set(group_by) | {agg.column for agg in aggregates if agg.column is not None}
+    if condition is not None:
+        columns |= condition_columns(condition)
+    scan = parallel_plan(ws, columns)
+    if scan is None:
+        return None
+    with plan_step("Parallel Hash Aggregate", f"{detail} (workers={scan.workers})") as op:
+        parts = scan.aggregate(condition, group_by, aggregates)
+        if parts is None:
+            return None
+        METRICS.add("rows.scanned", ws.base_rows)
+        METRICS.add("parallel.tasks", scan.workers)
+        aggregator = HashAggregator(aggregates, column_types(ws), max_groups)
+        for states in parts:
+            aggregator.add_states(states)
+        # Rows appended after the table file was written are added here.
+        rids = range(scan.rows, ws.base_rows)
+        if condition is not None:
+            compiled = compile_condition(condition, ws)
+            rids = [rid for rid in rids if compiled.matches(ws, rid)]
+        add_rows(aggregator, ws, rids, group_by, aggregates)
+        return _results(aggregator, group_by, aggregates, op, detail)
+
+
+def _results(aggregator, group_by, aggregates, op, detail):
+    results = list(aggregator.results())
+    if not results and not group_by:
+        results = [((), [0 if agg.function == "COUNT" else None for agg in aggregates])]
+    if aggregator.partitions is not None:
+        op.detail = f"{detail} (spilled to {SPILL_PARTITIONS} partitions)"
+    op.rows = len(results)
+    return results
+
+
+def compile_having(node, ws, group_by, aggregates):
+    # Result rows are dicts keyed by group column, aggregate label and alias;
+    # their get(name, default) matches what the filters call on a workspace.
+    named = {}
+    for agg in aggregates:
+        named[agg.label] = agg
+        if agg.alias:
+            named[agg.alias] = agg
+
+    def leaf_filter(leaf):
+        name = leaf.column
+        if isinstance(leaf, Comparison) and isinstance(leaf.value, ColumnRef):
+            raise ValueError("HAVING compares a column with a value, not another column.")
+        if name in group_by:
+            return build_leaf(leaf, partial(ws.convert, name), ws.base[name].type == "TEXT")
+        agg = named.get(name)
+        if agg is None:
+            raise ValueError(f"HAVING column '{name}' must be a GROUP BY column or an aggregate.")
+        if agg.function in ("MIN", "MAX"):
+            return build_leaf(leaf, partial(ws.convert, agg.column), ws.base[agg.column].type == "TEXT")
+        return build_leaf(leaf, partial(convert_value, "FLOAT"), False)
+    return compile_tree(node, leaf_filter)
@@ -0,0 +1,51 @@
+import argparse
+import json
+import sys
+
+REGRESSION_THRESHOLD = 0.10
+
+
+def load(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report["meta"], {(r["name"], r["rows"]): r for r in report["results"]}
+
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="relative throughput drop counted as a regression (default 0.10)")
+    args = parser.parse_args()
+
+    old_meta, old = load(args.baseline)
+    new_meta, new = load(args.candidate)
+    print(f"baseline {old_meta.get('commit')} vs candidate {new_meta.get('commit')}")
+    print(f"{'case':<24} {'rows':>9} {'old ops/s':>12} {'new ops/s':>12} {'change':>8} {'old p99':>10} {'new p99':>10}")
+    regressions = []
+    for key in sorted(old.keys() & new.keys(), key=lambda k: (k[1], k[0])):
+        a, b = old[key], new[key]
+        delta = change(a["ops_per_sec"], b["ops_per_sec"])
+        flag = ""
+        if delta is not None and delta < -args.threshold:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        shown = "n/a" if delta is None else f"{delta * 100:+.1f}%"
+        print(f"{key[0]:<24} {key[1]:>9} {a['ops_per_sec'] or 0:>12.1f} {b['ops_per_sec'] or 0:>12.1f} "
+              f"{shown:>8} {a['p99_ms']:>8.3f}ms {b['p99_ms']:>8.3f}ms{flag}")
+    for key in sorted(old.keys() ^ new.keys()):
+        print(f"{key[0]:<24} {key[1]:>9} only in {'baseline' if key in old else 'candidate'}")
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold * 100:.0f}%.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
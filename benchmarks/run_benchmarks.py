@@ -0,0 +1,301 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database_cli import DatabaseCLI
+from output import captured_output
+from parallel import max_workers
+from sql_parser import Comparison
+
+SIZES = {"10k": 10000, "100k": 100000, "1m": 1000000, "10m": 10000000}
+TABLE = "bench"
+OPERATIONS = 1000
+SCAN_OPERATIONS = 20
+INSERT_BATCH = 1000
+INSERT_ROWS_LIMIT = 100000
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(name, rows, latencies, elapsed=None, extra=None):
+    ordered = sorted(latencies)
+    elapsed = sum(latencies) if elapsed is None else elapsed
+    result = {
+        "name": name,
+        "rows": rows,
+        "ops": len(latencies),
+        "seconds": round(elapsed, 6),
+        "ops_per_sec": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(ordered, 0.5) * 1000, 4),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 4),
+        "max_ms": round(ordered[-1] * 1000, 4),
+    }
+    result.update(extra or {})
+    return result
+
+
+def run_statements(cli, statements):
+    latencies = []
+    for sql, params in statements:
+        start = time.perf_counter()
+        with captured_output():
+            cli.execute_command(sql, params)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def write_dataset(path, rows, seed):
+    rng = random.Random(seed)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "k", "name", "score"])
+        for i in range(rows):
+            writer.writerow([i, rng.randrange(1000), f"name{rng.randrange(rows)}", round(rng.random() * 100, 3)])
+
+
+class BenchmarkRun:
+    def __init__(self, rows, seed, operations, readers, writers, parallel, log):
+        self.rows = rows
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.operations = operations
+        self.readers = readers
+        self.writers = writers
+        self.log = log
+        self.cli = DatabaseCLI()
+        self.results = []
+        run_statements(self.cli, [(f"SET PARALLEL {parallel}", ())])
+
+    def record(self, result):
+        self.results.append(result)
+        self.log(f"{result['name']:<24} rows={result['rows']:<9} ops={result['ops']:<6} "
+                 f"{result['ops_per_sec'] or 0:>11.1f} ops/s  p50 {result['p50_ms']:.3f} ms  "
+                 f"p99 {result['p99_ms']:.3f} ms")
+
+    def single(self, name, sql, extra=None):
+        latencies = run_statements(self.cli, [(sql, ())])
+        self.record(summarize(name, self.rows, latencies, extra=extra))
+
+    def keys(self, count):
+        return [self.rng.randrange(self.rows) for _ in range(count)]
+
+    def run(self, selected):
+        cases = [
+            ("ingest_copy", self.ingest_copy),
+            ("ingest_insert", self.ingest_insert),
+            ("insert_single", self.insert_single),
+            ("pk_lookup", self.pk_lookup),
+            ("pk_lookup_transaction", self.pk_lookup_transaction),
+            ("filtered_scan", self.filtered_scan),
+            ("aggregate", self.aggregate),
+            ("order_by_limit", self.order_by_limit),
+            ("indexed", self.indexed),
+            ("update_by_key", self.update_by_key),
+            ("delete_by_key", self.delete_by_key),
+            ("concurrent", self.concurrent),
+            ("alter_table", self.alter_table),
+        ]
+        for name, case in cases:
+            if name == "ingest_copy" or not selected or name in selected:
+                case()
+        return self.results
+
+    def ingest_copy(self):
+        path = os.path.abspath("dataset.csv")
+        write_dataset(path, self.rows, self.seed)
+        run_statements(self.cli, [(f"CREATE TABLE {TABLE} (id INT, k INT, name TEXT, score FLOAT, PRIMARY KEY(id))", ())])
+        latencies = run_statements(self.cli, [(f"COPY {TABLE} FROM ?", (path,))])
+        self.record(summarize("ingest_copy", self.rows, latencies,
+                              extra={"rows_per_sec": round(self.rows / latencies[0], 1)}))
+        os.remove(path)
+
+    def ingest_insert(self):
+        rows = min(self.rows, INSERT_ROWS_LIMIT)
+        run_statements(self.cli, [("CREATE TABLE bench_insert (id INT, k INT, name TEXT, PRIMARY KEY(id))", ())])
+        statements = []
+        for start in range(0, rows, INSERT_BATCH):
+            values = ", ".join(f"({i}, {i % 1000}, 'name{i}')" for i in range(start, min(rows, start + INSERT_BATCH)))
+            statements.append((f"INSERT INTO bench_insert VALUES {values}", ()))
+        latencies = run_statements(self.cli, statements)
+        self.record(summarize("ingest_insert", rows, latencies,
+                              extra={"rows_per_sec": round(rows / sum(latencies), 1)}))
+
+    def insert_single(self):
+        start = min(self.rows, INSERT_ROWS_LIMIT)
+        statements = [("INSERT INTO bench_insert VALUES (?, ?, ?)", (start + i, i % 1000, f"single{i}"))
+                      for i in range(self.operations)]
+        self.record(summarize("insert_single", self.rows, run_statements(self.cli, statements)))
+
+    def pk_lookup(self):
+        statements = [(f"SELECT * FROM {TABLE} WHERE id = ?", (key,)) for key in self.keys(self.operations)]
+        self.record(summarize("pk_lookup", self.rows, run_statements(self.cli, statements)))
+
+    def pk_lookup_transaction(self):
+        # The same lookups through Transaction directly, without parsing.
+        latencies = []
+        for key in self.keys(self.operations):
+            start = time.perf_counter()
+            with captured_output():
+                tx = self.cli.tm.begin_transaction([TABLE], True)
+                tx.read_table_with_condition(TABLE, Comparison("id", "=", key))
+                tx.commit()
+            latencies.append(time.perf_counter() - start)
+        self.record(summarize("pk_lookup_transaction", self.rows, latencies))
+
+    def filtered_scan(self, name="filtered_scan"):
+        statements = [(f"SELECT id, score FROM {TABLE} WHERE k = ? AND score > ?", (self.rng.randrange(1000), 50))
+                      for _ in range(SCAN_OPERATIONS)]
+        self.record(summarize(name, self.rows, run_statements(self.cli, statements)))
+
+    def aggregate(self):
+        sql = f"SELECT k, COUNT(*), AVG(score) FROM {TABLE} WHERE score > ? GROUP BY k"
+        statements = [(sql, (self.rng.random() * 100,)) for _ in range(SCAN_OPERATIONS)]
+        self.record(summarize("aggregate", self.rows, run_statements(self.cli, statements)))
+
+    def order_by_limit(self, name="order_by_limit", column="score"):
+        statements = [(f"SELECT * FROM {TABLE} ORDER BY {column} DESC LIMIT 10", ())] * SCAN_OPERATIONS
+        self.record(summarize(name, self.rows, run_statements(self.cli, statements)))
+
+    def indexed(self):
+        self.single("create_index", f"CREATE INDEX bench_k ON {TABLE}(k)")
+        self.filtered_scan("filtered_scan_indexed")
+        self.order_by_limit("order_by_limit_indexed", "k")
+
+    def update_by_key(self):
+        statements = [(f"UPDATE {TABLE} SET score = ? WHERE id = ?", (self.rng.random() * 100, key))
+                      for key in self.keys(self.operations)]
+        self.record(summarize("update_by_key", self.rows, run_statements(self.cli, statements)))
+
+    def delete_by_key(self):
+        keys = self.rng.sample(range(self.rows), min(self.rows // 2, self.operations))
+        statements = [(f"DELETE FROM {TABLE} WHERE id = ?", (key,)) for key in keys]
+        self.record(summarize("delete_by_key", self.rows, run_statements(self.cli, statements)))
+
+    def concurrent(self):
+        # Readers and writers run as separate sessions on one TableManager,
+        # as server connections do.
+        ready = threading.Barrier(self.readers + self.writers + 1)
+        reads = [[] for _ in range(self.readers)]
+        writes = [[] for _ in range(self.writers)]
+
+        def worker(latencies, seed, write):
+            cli = DatabaseCLI(self.cli.tm, self.cli.plans)
+            rng = random.Random(seed)
+            if write:
+                statements = [(f"UPDATE {TABLE} SET score = ? WHERE id = ?", (rng.random() * 100, rng.randrange(self.rows)))
+                              for _ in range(self.operations)]
+            else:
+                statements = [(f"SELECT * FROM {TABLE} WHERE id = ?", (rng.randrange(self.rows),))
+                              for _ in range(self.operations)]
+            ready.wait()
+            latencies.extend(run_statements(cli, statements))
+
+        threads = [threading.Thread(target=worker, args=(reads[i], self.seed + i, False)) for i in range(self.readers)]
+        threads += [threading.Thread(target=worker, args=(writes[i], self.seed + 100 + i, True))
+                    for i in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        ready.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        extra = {"readers": self.readers, "writers": self.writers}
+        read_latencies = [t for timings in reads for t in timings]
+        write_latencies = [t for timings in writes for t in timings]
+        if read_latencies:
+            self.record(summarize("concurrent_read", self.rows, read_latencies, elapsed, extra))
+        if write_latencies:
+            self.record(summarize("concurrent_write", self.rows, write_latencies, elapsed, extra))
+
+    def alter_table(self):
+        self.single("alter_add_column", f"ALTER TABLE {TABLE} ADD COLUMN note TEXT")
+        self.single("alter_rename_column", f"ALTER TABLE {TABLE} RENAME COLUMN note TO remark")
+        self.single("alter_drop_column", f"ALTER TABLE {TABLE} DROP COLUMN remark")
+
+
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    return SIZES[text] if text in SIZES else int(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the MiniDatabase benchmark suite.")
+    parser.add_argument("--sizes", default="10k", help="comma-separated row counts, e.g. 10k,1m,10m")
+    parser.add_argument("--cases", default="", help="comma-separated case names to run (default: all)")
+    parser.add_argument("--operations", type=int, default=OPERATIONS, help="operations per latency case")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--parallel", type=int, default=0, help="scan workers per query (default: one per core)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", default=None, help="directory for the benchmark databases")
+    parser.add_argument("--output", default=None, help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    log = lambda message: print(message, file=sys.stderr)
+    selected = {name.strip() for name in args.cases.split(",") if name.strip()}
+    workdir = tempfile.mkdtemp(prefix="minidb-bench-", dir=args.workdir)
+    start_dir = os.getcwd()
+    results = []
+    try:
+        for size in args.sizes.split(","):
+            rows = parse_size(size)
+            run_dir = os.path.join(workdir, str(rows))
+            os.makedirs(run_dir)
+            os.chdir(run_dir)
+            log(f"== {rows} rows")
+            run = BenchmarkRun(rows, args.seed, args.operations, args.readers, args.writers, args.parallel, log)
+            results.extend(run.run(selected))
+            run.cli.tm.wait_for_compactions()
+            run.cli.tm.wait_for_checkpoint()
+            run.cli.tm.wal.close()
+            os.chdir(start_dir)
+    finally:
+        os.chdir(start_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "operations": args.operations,
+            "parallel": max_workers(),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        log(f"Results written to {args.output}.")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
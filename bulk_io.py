@@ -0,0 +1,88 @@
+import csv
+import json
+from itertools import islice
+from column_store import format_value
+
+COPY_BATCH_ROWS = 10000
+JSON_EXTENSIONS = (".jsonl", ".ndjson", ".json")
+
+
+def file_format(path):
+    return "JSONL" if path.lower().endswith(JSON_EXTENSIONS) else "CSV"
+
+
+def read_batches(path, columns, batch_size=COPY_BATCH_ROWS):
+    # Yields lists of rows in table column order, so only one batch of the
+    # file is held in memory at a time.
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = _json_rows(f, columns) if file_format(path) == "JSONL" else _csv_rows(f, columns)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return
+            yield batch
+
+
+def _csv_rows(f, columns):
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [name.strip() for name in header]
+    _check_names(header, columns)
+    positions = [header.index(col) for col in columns]
+    in_order = positions == list(range(len(header)))
+    for record in reader:
+        if not record:
+            continue
+        if len(record) != len(header):
+            raise ValueError(f"Line {reader.line_num}: expected {len(header)} values but got {len(record)}.")
+        yield record if in_order else [record[pos] for pos in positions]
+
+
+def _json_rows(f, columns):
+    for line_num, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ValueError(f"Line {line_num}: invalid JSON.")
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {line_num}: expected a JSON object.")
+        if len(record) != len(columns) or any(col not in record for col in columns):
+            try:
+                _check_names(list(record), columns)
+            except ValueError as e:
+                raise ValueError(f"Line {line_num}: {e}")
+        yield [record[col] for col in columns]
+
+
+def _check_names(names, columns):
+    for name in names:
+        if name not in columns:
+            raise ValueError(f"Unknown column '{name}'.")
+    for col in columns:
+        if col not in names:
+            raise ValueError(f"Missing column '{col}'.")
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicate column names.")
+
+
+def write_rows(path, headers, rows):
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        if file_format(path) == "JSONL":
+            for row in rows:
+                f.write(json.dumps(dict(zip(headers, row))) + "\n")
+                count += 1
+            return count
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, COPY_BATCH_ROWS))
+            if not batch:
+                return count
+            writer.writerows([format_value(v) for v in row] for row in batch)
+            count += len(batch)
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+CATALOG_FILE = "catalog.json"
+CATALOG_VERSION = 1
+
+
+class TableMetadata:
+    def __init__(self, primary_key, unique_keys, checkpoint_lsn=0, column_types=None, indexes=None,
+                 row_count=0, stats=None, schema_version=0, stored=None, defaults=None):
+        self.primary_key = primary_key
+        self.unique_keys = set(unique_keys)
+        self.checkpoint_lsn = checkpoint_lsn
+        self.column_types = dict(column_types or {})
+        self.indexes = dict(indexes or {})
+        self.row_count = row_count
+        self.stats = dict(stats or {})
+        # Metadata-only ALTER TABLE leaves the table file behind the schema
+        # until it is compacted: stored maps each column to its name in that
+        # file (missing ones read as their default), and files record the
+        # schema_version they were written at. None means the file matches.
+        self.schema_version = schema_version
+        self.stored = stored
+        self.defaults = dict(defaults or {})
+
+    def column_type(self, column):
+        return self.column_types.get(column, "TEXT")
+
+    def columns(self):
+        return list(self.column_types)
+
+    def file_column(self, column):
+        return column if self.stored is None else self.stored.get(column)
+
+    def schema_changed(self):
+        if self.stored is None:
+            self.stored = {col: col for col in self.column_types}
+        self.schema_version += 1
+
+    def file_written(self):
+        self.stored = None
+        self.defaults = {}
+
+    def to_dict(self):
+        return {
+            "primary_key": self.primary_key,
+            "unique_keys": sorted(self.unique_keys),
+            "checkpoint_lsn": self.checkpoint_lsn,
+            "columns": [[col, col_type] for col, col_type in self.column_types.items()],
+            "indexes": self.indexes,
+            "row_count": self.row_count,
+            "stats": self.stats,
+            "schema_version": self.schema_version,
+            "stored": self.stored,
+            "defaults": self.defaults,
+        }
+
+    @classmethod
+    def from_dict(cls, entry):
+        return cls(entry["primary_key"], entry["unique_keys"], entry["checkpoint_lsn"],
+                   entry["columns"], entry["indexes"], entry["row_count"], entry["stats"],
+                   entry.get("schema_version", 0), entry.get("stored"), entry.get("defaults"))
+
+
+def collect_stats(data, previous):
+    # Columns still mapped from the table file have not changed since their
+    # stats were taken, so only loaded columns are recomputed.
+    stats = {}
+    for col, column in data.items():
+        if getattr(column, "column", True) is None:
+            stats[col] = previous.get(col, {})
+        else:
+            stats[col] = column.stats()
+    return stats
+
+
+class Catalog:
+    # Schemas, constraints, row counts and column statistics for every table,
+    # kept in memory and written to one file. Saving replaces the file
+    # atomically, so each save is the commit point of a schema change.
+    def __init__(self, data_dir):
+        self.path = os.path.join(data_dir, CATALOG_FILE)
+        self.tables = {}
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.dirty = False
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        with open(self.path, "r") as f:
+            document = json.load(f)
+        if document.get("version") != CATALOG_VERSION:
+            raise ValueError(f"Unsupported catalog version in '{self.path}'.")
+        self.tables = {name: TableMetadata.from_dict(entry) for name, entry in document["tables"].items()}
+
+    def get(self, table_name):
+        return self.tables.get(table_name)
+
+    def __contains__(self, table_name):
+        return table_name in self.tables
+
+    def names(self):
+        return sorted(self.tables)
+
+    def put(self, table_name, meta):
+        with self.lock:
+            self.tables[table_name] = meta
+            self.save()
+
+    def remove(self, table_name):
+        with self.lock:
+            meta = self.tables.pop(table_name, None)
+            self.save()
+            return meta
+
+    @contextmanager
+    def batch(self):
+        # Saves inside the block are deferred to a single write at the end.
+        with self.lock:
+            self.depth += 1
+            try:
+                yield self
+            finally:
+                self.depth -= 1
+                if self.depth == 0 and self.dirty:
+                    self.save()
+
+    def save(self):
+        with self.lock:
+            if self.depth:
+                self.dirty = True
+                return
+            document = {"version": CATALOG_VERSION,
+                        "tables": {name: meta.to_dict() for name, meta in self.tables.items()}}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.write(json.dumps(document, separators=(",", ":")))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+
+def read_meta_file(path):
+    # Per-table .meta.txt files written before the catalog existed.
+    primary_key = None
+    unique_keys = set()
+    checkpoint_lsn = 0
+    column_types = {}
+    indexes = {}
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("PRIMARY_KEY="):
+                primary_key = line.strip().split("=")[1]
+            elif line.startswith("UNIQUE_KEYS="):
+                unique_keys.update(line.strip().split("=")[1].split(","))
+            elif line.startswith("CHECKPOINT_LSN="):
+                checkpoint_lsn = int(line.strip().split("=")[1])
+            elif line.startswith("COLUMN_TYPES="):
+                for spec in line.strip().split("=", 1)[1].split(","):
+                    col, col_type = spec.rsplit(":", 1)
+                    column_types[col] = col_type
+            elif line.startswith("INDEXES="):
+                for spec in line.strip().split("=", 1)[1].split(","):
+                    index_name, col = spec.split(":", 1)
+                    indexes[index_name] = col
+    return TableMetadata(primary_key, unique_keys, checkpoint_lsn, column_types, indexes)
@@ -0,0 +1,92 @@
+import queue
+import socket
+import threading
+from contextlib import contextmanager
+from protocol import DEFAULT_ADDRESS, parse_address, recv_message, send_message
+
+POOL_SIZE = 8
+
+
+class Connection:
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        family, target = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(target)
+        except OSError:
+            self.sock.close()
+            raise
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.in_transaction = False
+
+    def execute(self, sql, params=()):
+        send_message(self.sock, {"sql": sql, "params": list(params)})
+        response = recv_message(self.sock)
+        if response is None:
+            raise ConnectionError("Server closed the connection.")
+        self.in_transaction = response["in_transaction"]
+        if not response["ok"]:
+            raise Exception(response["error"])
+        return response["output"]
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ConnectionPool:
+    # Hands out up to size connections; idle ones are reused most recently
+    # used first. A connection returned inside a transaction is rolled back,
+    # and one that hit a socket error is dropped.
+    def __init__(self, address=DEFAULT_ADDRESS, size=POOL_SIZE, timeout=None):
+        self.address = address
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        self.slots.acquire()
+        try:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = Connection(self.address, self.timeout)
+        except Exception:
+            self.slots.release()
+            raise
+        broken = False
+        try:
+            yield conn
+        except OSError:
+            broken = True
+            raise
+        finally:
+            if not broken and conn.in_transaction:
+                try:
+                    conn.execute("ROLLBACK")
+                except OSError:
+                    broken = True
+            if broken:
+                conn.close()
+            else:
+                self.idle.put(conn)
+            self.slots.release()
+
+    def execute(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
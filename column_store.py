@@ -0,0 +1,255 @@
+import sys
+import threading
+from array import array
+from itertools import repeat
+
+COLUMN_TYPES = ("INT", "FLOAT", "TEXT", "BOOL")
+TYPECODES = {"INT": "q", "FLOAT": "d", "BOOL": "b"}
+TRUE_VALUES = ("true", "t", "1", "yes")
+FALSE_VALUES = ("false", "f", "0", "no", "")
+
+
+def convert_value(col_type, value):
+    if col_type == "TEXT":
+        return value if isinstance(value, str) else format_value(value)
+    if col_type == "BOOL":
+        if isinstance(value, bool):
+            return value
+        text = str(value).strip().lower()
+        if text in TRUE_VALUES:
+            return True
+        if text in FALSE_VALUES:
+            return False
+        raise ValueError(f"Invalid BOOL value '{value}'.")
+    if isinstance(value, str):
+        value = value.strip() or "0"
+    try:
+        return int(value) if col_type == "INT" else float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {col_type} value '{value}'.")
+
+
+def format_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def make_column(col_type, values=()):
+    if col_type == "TEXT":
+        return TextColumn(values)
+    if col_type in TYPECODES:
+        return NumericColumn(col_type, values)
+    raise ValueError(f"Unknown column type '{col_type}'.")
+
+
+def _find_in_array(values, target, stop):
+    positions = []
+    start = 0
+    try:
+        while True:
+            pos = values.index(target, start, stop)
+            positions.append(pos)
+            start = pos + 1
+    except ValueError:
+        return positions
+
+
+class NumericColumn:
+    def __init__(self, col_type, values=()):
+        self.type = col_type
+        self.values = array(TYPECODES[col_type], (convert_value(col_type, v) for v in values))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        if self.type == "BOOL":
+            return map(bool, self.values)
+        return iter(self.values)
+
+    def __getitem__(self, pos):
+        if self.type == "BOOL":
+            return bool(self.values[pos])
+        return self.values[pos]
+
+    def __setitem__(self, pos, value):
+        self.values[pos] = convert_value(self.type, value)
+
+    def convert(self, value):
+        return convert_value(self.type, value)
+
+    def append(self, value):
+        self.values.append(convert_value(self.type, value))
+
+    def extend(self, values):
+        if isinstance(values, NumericColumn) and values.type == self.type:
+            self.values.extend(values.values)
+            return
+        self.values.extend(convert_value(self.type, v) for v in values)
+
+    def copy(self):
+        column = NumericColumn.__new__(NumericColumn)
+        column.type = self.type
+        column.values = array(self.values.typecode, self.values)
+        return column
+
+    def without(self, positions):
+        column = NumericColumn.__new__(NumericColumn)
+        column.type = self.type
+        column.values = array(self.values.typecode,
+                              (v for i, v in enumerate(self.values) if i not in positions))
+        return column
+
+    def find_equal(self, value, stop=None):
+        return _find_in_array(self.values, convert_value(self.type, value),
+                              len(self.values) if stop is None else stop)
+
+    def sort_positions(self, positions, reverse=False):
+        return sorted(positions, key=self.values.__getitem__, reverse=reverse)
+
+    def memory_bytes(self):
+        return self.values.itemsize * len(self.values)
+
+    def stats(self):
+        if not self.values:
+            return {}
+        low, high = min(self.values), max(self.values)
+        if self.type == "BOOL":
+            low, high = bool(low), bool(high)
+        return {"min": low, "max": high}
+
+
+class TextColumn:
+    type = "TEXT"
+
+    def __init__(self, values=()):
+        self.dictionary = []
+        self.lookup = {}
+        self.dictionary_bytes = 0
+        self.codes = array("i", (self._encode(v) for v in values))
+
+    def _encode(self, value):
+        code = self.lookup.get(value)
+        if code is None:
+            code = len(self.dictionary)
+            self.dictionary.append(value)
+            self.lookup[value] = code
+            self.dictionary_bytes += sys.getsizeof(value) + 8
+        return code
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        return map(self.dictionary.__getitem__, self.codes)
+
+    def __getitem__(self, pos):
+        return self.dictionary[self.codes[pos]]
+
+    def __setitem__(self, pos, value):
+        self.codes[pos] = self._encode(convert_value("TEXT", value))
+
+    def convert(self, value):
+        return convert_value("TEXT", value)
+
+    def append(self, value):
+        self.codes.append(self._encode(convert_value("TEXT", value)))
+
+    def extend(self, values):
+        if isinstance(values, TextColumn):
+            # Each distinct value is encoded once, then the codes are mapped.
+            codes = [self._encode(value) for value in values.dictionary]
+            self.codes.extend(map(codes.__getitem__, values.codes))
+            return
+        self.codes.extend(self._encode(convert_value("TEXT", v)) for v in values)
+
+    def _sharing_dictionary(self, codes):
+        # The dictionary is append-only, so copies share it with older versions.
+        column = TextColumn.__new__(TextColumn)
+        column.dictionary = self.dictionary
+        column.lookup = self.lookup
+        column.dictionary_bytes = self.dictionary_bytes
+        column.codes = codes
+        return column
+
+    def copy(self):
+        return self._sharing_dictionary(array("i", self.codes))
+
+    def without(self, positions):
+        return self._sharing_dictionary(array("i", (c for i, c in enumerate(self.codes) if i not in positions)))
+
+    def find_equal(self, value, stop=None):
+        code = self.lookup.get(value)
+        if code is None:
+            return []
+        return _find_in_array(self.codes, code, len(self.codes) if stop is None else stop)
+
+    def sort_positions(self, positions, reverse=False):
+        dictionary = self.dictionary
+        codes = self.codes
+        return sorted(positions, key=lambda pos: dictionary[codes[pos]], reverse=reverse)
+
+    def memory_bytes(self):
+        return self.codes.itemsize * len(self.codes) + self.dictionary_bytes
+
+    def stats(self):
+        return {"distinct": len(set(self.codes))} if self.codes else {}
+
+
+class DefaultColumn:
+    # Stands in for a column added by ALTER TABLE: existing rows read the
+    # default, and the column is only built when something writes to it or
+    # needs its buffers.
+    load_lock = threading.Lock()
+
+    def __init__(self, col_type, default, rows):
+        self.type = col_type
+        self.default = default
+        self.rows = rows
+        self.column = None
+
+    def load(self):
+        if self.column is None:
+            with DefaultColumn.load_lock:
+                if self.column is None:
+                    column = make_column(self.type, [self.default])
+                    if self.type == "TEXT":
+                        column.codes = column.codes * self.rows
+                    else:
+                        column.values = column.values * self.rows
+                    self.column = column
+        return self.column
+
+    def __len__(self):
+        return self.rows if self.column is None else len(self.column)
+
+    def __iter__(self):
+        if self.column is None:
+            return repeat(self.default, self.rows)
+        return iter(self.column)
+
+    def __getitem__(self, pos):
+        if self.column is None:
+            if not -self.rows <= pos < self.rows:
+                raise IndexError("column index out of range")
+            return self.default
+        return self.column[pos]
+
+    def __setitem__(self, pos, value):
+        self.load()[pos] = value
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def memory_bytes(self):
+        return 0 if self.column is None else self.column.memory_bytes()
+
+    def stats(self):
+        if self.column is None:
+            return make_column(self.type, [self.default]).stats() if self.rows else {}
+        return self.column.stats()
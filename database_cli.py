@@ -1,14 +1,33 @@
+import time
+from contextlib import contextmanager
+from column_store import format_value
+from metrics import METRICS, tracing
+from output import captured_output
+from parallel import max_workers, set_max_workers
+from sql_parser import (AlterTable, Begin, Commit, Copy, CreateIndex, CreateTable, Delete, Describe, DropIndex,
+                        DropTable, Explain, Insert, PlanCache, ResetStats, Rollback, Select, SetParallel, SetStats,
+                        ShowStats, ShowTables, Update, bind_value)
 from table_manager import TableManager
 from transaction import Transaction
 
+SCHEMA_STATEMENTS = (CreateTable, CreateIndex, DropTable, DropIndex, AlterTable)
+
 class DatabaseCLI:
-    def __init__(self):
-        self.tm = TableManager()
+    def __init__(self, tm=None, plans=None):
+        self.tm = tm if tm is not None else TableManager()
+        self.plans = plans if plans is not None else PlanCache()
+        self.session = None
+        self.session_failed = False
+        self.dry_run = False
 
     def start(self):
         while True:
             command = input("db> ").strip()
+            if not command:
+                continue
             if command.upper() == "EXIT":
+                if self.close():
+                    print("Open transaction rolled back.")
                 print("Exiting database CLI.")
                 break
             try:
@@ -16,191 +35,250 @@ class DatabaseCLI:
             except Exception as e:
                 print(f"Error: {e}")
 
-    def execute_command(self, command):
-        upper_command = command.upper()
-
-        if upper_command.startswith("CREATE TABLE"):
-            self._handle_create_table(command)
-
-        elif upper_command.startswith("INSERT INTO"):
-            self._handle_insert(command)
-
-        elif upper_command.startswith("SELECT"):
-            self._handle_select(command)
-
-        elif upper_command.startswith("UPDATE"):
-            self._handle_update(command)
-
-        elif upper_command.startswith("DELETE FROM"):
-            self._handle_delete(command)
-
-        elif upper_command.startswith("DROP TABLE"):
-            table_name = command[len("DROP TABLE "):].strip()
-            self.tm.drop_table(table_name)
-
-        elif upper_command == "SHOW TABLES":
+    def execute_command(self, command, params=()):
+        statement = self.plans.get(command)
+        if len(params) != statement.param_count:
+            raise ValueError(f"Expected {statement.param_count} parameter(s) but got {len(params)}.")
+
+        if isinstance(statement, (Begin, Commit, Rollback)):
+            self._handle_session(statement)
+            return
+        if self.session is not None:
+            if self.session_failed:
+                raise Exception("Current transaction is aborted; ROLLBACK to end it.")
+            if isinstance(statement, SCHEMA_STATEMENTS):
+                raise Exception("Schema changes are not allowed inside a transaction.")
+        try:
+            with METRICS.timer(f"statement.{type(statement).__name__.lower()}"):
+                self._execute(statement, params)
+        except Exception:
+            # A failed statement may have written part of its changes to the
+            # session workspace, so the whole transaction can only roll back.
+            if self.session is not None:
+                self.session_failed = True
+            raise
+
+    def _execute(self, statement, params):
+        if isinstance(statement, CreateTable):
+            self.tm.create_table(statement.table, statement.columns, statement.primary_key,
+                                 statement.unique_keys, statement.column_types)
+
+        elif isinstance(statement, CreateIndex):
+            self.tm.create_index(statement.table, statement.name, statement.column)
+
+        elif isinstance(statement, Insert):
+            self._handle_insert(statement, params)
+
+        elif isinstance(statement, Copy):
+            self._handle_copy(statement, params)
+
+        elif isinstance(statement, Select):
+            self._handle_select(statement, params)
+
+        elif isinstance(statement, Update):
+            self._handle_update(statement, params)
+
+        elif isinstance(statement, Delete):
+            self._handle_delete(statement, params)
+
+        elif isinstance(statement, DropTable):
+            self.tm.drop_table(statement.table)
+
+        elif isinstance(statement, DropIndex):
+            self.tm.drop_index(statement.name, statement.table)
+
+        elif isinstance(statement, ShowTables):
             self.tm.show_tables()
 
-        elif upper_command.startswith("DESCRIBE"):
-            table_name = command[len("DESCRIBE "):].strip()
-            self.tm.describe_table(table_name)
-
-        elif upper_command.startswith("ALTER TABLE"):
-            self._handle_alter_table(command)
-
+        elif isinstance(statement, Describe):
+            self.tm.describe_table(statement.table)
+
+        elif isinstance(statement, Explain):
+            self._handle_explain(statement, params)
+
+        elif isinstance(statement, ShowStats):
+            self._show_stats(statement.as_json)
+
+        elif isinstance(statement, SetStats):
+            METRICS.enabled = statement.enabled
+            print(f"Statistics {'enabled' if statement.enabled else 'disabled'}.")
+
+        elif isinstance(statement, SetParallel):
+            set_max_workers(statement.workers)
+            print(f"Parallel workers set to {max_workers()}.")
+
+        elif isinstance(statement, ResetStats):
+            METRICS.reset()
+            self.plans.hits = self.plans.misses = 0
+            print("Statistics reset.")
+
+        elif isinstance(statement, AlterTable):
+            self._handle_alter_table(statement)
+
+    def _handle_session(self, statement):
+        if isinstance(statement, Begin):
+            if self.session is not None:
+                raise Exception("A transaction is already in progress.")
+            self.session = self.tm.begin_transaction([], False)
+            self.session_failed = False
+            print("Transaction started.")
+            return
+        if self.session is None:
+            raise Exception("No transaction in progress.")
+        if isinstance(statement, Commit) and not self.session_failed:
+            self._end_session(True)
+            print("Transaction committed.")
         else:
-            print("Unknown command.")
-
-    def _handle_create_table(self, command):
-        table_start = len("CREATE TABLE ")
-        paren_start = command.index("(")
-        table_name = command[table_start:paren_start].strip()
-        paren_end = command.rindex(")")
-        spec_str = command[paren_start + 1:paren_end]
-
-        columns = []
-        primary_key = None
-        unique_keys = set()
-
-        for spec in spec_str.split(","):
-            spec = spec.strip()
-            if spec.upper().startswith("PRIMARY KEY"):
-                primary_key = spec[len("PRIMARY KEY"):].strip().replace("(", "").replace(")", "")
-            elif spec.upper().startswith("UNIQUE"):
-                key = spec[len("UNIQUE"):].strip().replace("(", "").replace(")", "")
-                unique_keys.add(key)
-            else:
-                columns.append(spec)
-
-        if not primary_key:
-            raise ValueError("A PRIMARY KEY must be specified for table creation.")
-
-        self.tm.create_table(table_name, columns, primary_key, unique_keys)
-
-    def _handle_insert(self, command):
-        into_index = command.upper().index("INTO") + 5
-        values_index = command.upper().index("VALUES")
-        table_name = command[into_index:values_index].strip()
-        values_str = command[values_index + 6:].strip()
-        values = self.parse_values(values_str)
-
-        tx = self.tm.begin_transaction([table_name], False)
-        tx.insert_row(table_name, values)
-        tx.commit()
-
-    def _handle_select(self, command):
-        command_upper = command.upper()
-
-        # Step 1: Break command into SELECT, FROM and remaining parts
-        select_index = command_upper.index("SELECT") + len("SELECT")
-        from_index = command_upper.index("FROM")
-        select_clause = command[select_index:from_index].strip()
-        columns = None if select_clause.strip() == "*" else [col.strip() for col in select_clause.split(",")]
-
-        # Initial parse for FROM clause
-        rest = command[from_index + len("FROM"):].strip()
-
-        # Initialize parts
-        table_name = None
-        where_clause = None
-        order_by = None
-        limit = None
-
-        # Helper to extract optional parts safely
-        def extract_clause(text, keyword):
-            idx = text.upper().find(keyword)
-            return (text[idx + len(keyword):].strip(), text[:idx].strip()) if idx != -1 else (None, text)
-
-        # Step 2: Parse optional LIMIT
-        limit_part, rest = extract_clause(rest, "LIMIT")
-        if limit_part:
-            limit = int(limit_part.split()[0])
-
-    # Step 3: Parse optional ORDER BY
-        order_part, rest = extract_clause(rest, "ORDER BY")
-        if order_part:
-            order_by = order_part.split()[0].strip()
-
-        # Step 4: Parse optional WHERE
-        where_part, rest = extract_clause(rest, "WHERE")
-        if where_part:
-            where_clause = self.parse_condition(where_part.strip())
-
-        # Remaining is the table name
-        table_name = rest.strip()
-
-        # Execute transaction
-        tx = self.tm.begin_transaction([table_name], True)
-        if where_clause:
-            tx.read_table_with_condition(table_name, *where_clause, columns, order_by, limit)
+            self._end_session(False)
+            print("Transaction rolled back.")
+
+    def close(self):
+        if self.session is None:
+            return False
+        self._end_session(False)
+        return True
+
+    def _end_session(self, commit):
+        session = self.session
+        self.session = None
+        self.session_failed = False
+        if commit:
+            session.commit()
         else:
-            tx.read_table(table_name, columns, order_by, limit)
-        tx.commit()
-
-
-    def _handle_update(self, command):
-        table_name = command[len("UPDATE "):command.upper().index("SET")].strip()
-        set_str = command[command.upper().index("SET") + 4:command.upper().index("WHERE")].strip()
-        where_str = command[command.upper().index("WHERE") + 6:].strip()
-
-        set_col, new_val = self.parse_condition(set_str)
-        where_col, where_val = self.parse_condition(where_str)
-
-        tx = self.tm.begin_transaction([table_name], False)
-        tx.update_rows(table_name, set_col, new_val, where_col, where_val)
-        tx.commit()
-
-    def _handle_delete(self, command):
-        table_name = command[len("DELETE FROM "):command.upper().index("WHERE")].strip()
-        column, value = self.parse_condition(command[command.upper().index("WHERE") + 6:].strip())
-
-        tx = self.tm.begin_transaction([table_name], False)
-        tx.delete_rows(table_name, column, value)
-        tx.commit()
+            session.rollback()
+
+    @contextmanager
+    def _transaction(self, tables, is_read_only):
+        # Inside BEGIN ... COMMIT every statement runs in the session
+        # transaction; otherwise each statement commits on its own. A dry run
+        # (plain EXPLAIN of a write) always rolls back on its own.
+        if self.session is not None and not self.dry_run:
+            self.session.add_tables(tables)
+            yield self.session
+            return
+        tx = self.tm.begin_transaction(tables, is_read_only)
+        try:
+            yield tx
+        except Exception:
+            tx.rollback()
+            raise
+        if self.dry_run:
+            tx.rollback()
+        else:
+            tx.commit()
+
+    def _handle_explain(self, statement, params):
+        inner = statement.statement
+        if not isinstance(inner, (Select, Insert, Update, Delete)):
+            raise ValueError("EXPLAIN supports SELECT, INSERT, UPDATE and DELETE.")
+        # Index use, join methods and sort strategy are chosen as the statement
+        # runs, so EXPLAIN runs it traced with its output discarded. Only
+        # EXPLAIN ANALYZE keeps the writes.
+        self.dry_run = not statement.analyze and not isinstance(inner, Select)
+        start = time.perf_counter()
+        try:
+            with tracing() as trace, captured_output():
+                self._execute(inner, params)
+        finally:
+            self.dry_run = False
+        elapsed = time.perf_counter() - start
+
+        print("QUERY PLAN")
+        for op in trace.operators:
+            line = "  " * op.depth + op.name + (f": {op.detail}" if op.detail else "")
+            if statement.analyze:
+                rows = "" if op.rows is None else f"rows={op.rows}, "
+                line += f" ({rows}time={op.seconds * 1000:.3f} ms)"
+            print(line)
+        if statement.analyze:
+            print(f"Execution time: {elapsed * 1000:.3f} ms")
+
+    def _show_stats(self, as_json):
+        extra = {
+            "plan_cache.hits": self.plans.hits,
+            "plan_cache.misses": self.plans.misses,
+            "tables.cached": len(self.tm.table_data),
+            "parallel.workers": max_workers(),
+            "memory.bytes": self.tm.memory_usage(),
+        }
+        if as_json:
+            print(METRICS.dump(extra))
+            return
+        print("metric,value")
+        for name, value in sorted({**METRICS.snapshot(), **extra}.items()):
+            print(f"{name},{format_value(value)}")
+
+    def _handle_insert(self, statement, params):
+        rows = [[bind_value(value, params) for value in values] for values in statement.rows]
+
+        with self._transaction([statement.table], False) as tx:
+            tx.insert_rows(statement.table, rows)
+
+    def _handle_copy(self, statement, params):
+        path = bind_value(statement.path, params)
+        if statement.direction == "TO":
+            with self._transaction([statement.table], True) as tx:
+                tx.copy_to(statement.table, path)
+            return
+
+        with self._transaction([statement.table], False) as tx:
+            tx.copy_from(statement.table, path)
+
+    def _handle_select(self, statement, params):
+        limit = statement.limit
+        if limit is not None:
+            limit = int(bind_value(limit, params))
+        offset = int(bind_value(statement.offset, params)) if statement.offset is not None else 0
+        if (limit is not None and limit < 0) or offset < 0:
+            raise ValueError("LIMIT and OFFSET must not be negative.")
+
+        if statement.joins:
+            if statement.aggregates or statement.group_by:
+                raise ValueError("GROUP BY and aggregates are not supported with JOIN.")
+            self._handle_join(statement, params, limit, offset)
+            return
+        if statement.aggregates or statement.group_by or statement.having:
+            self._handle_aggregate(statement, params, limit, offset)
+            return
+
+        with self._transaction([statement.table], True) as tx:
+            if statement.where:
+                tx.read_table_with_condition(statement.table, statement.where.bind(params),
+                                             statement.columns, statement.order_by, limit, offset)
+            else:
+                tx.read_table(statement.table, statement.columns, statement.order_by, limit, offset)
 
-    def _handle_alter_table(self, command):
-        parts = command.split()
-        table_name = parts[2]
-        sub_command = " ".join(parts[3:]).strip().upper()
+    def _handle_aggregate(self, statement, params, limit, offset):
+        where = statement.where.bind(params) if statement.where else None
+        having = statement.having.bind(params) if statement.having else None
 
-        if sub_command.startswith("ADD COLUMN"):
-            column_name = command.upper().split("ADD COLUMN", 1)[1].strip()
-            self.tm.alter_add_column(table_name, column_name)
+        with self._transaction([statement.table], True) as tx:
+            tx.read_aggregate(statement.table, statement.columns, where, statement.group_by, statement.aggregates,
+                              having, statement.order_by, limit, offset)
 
-        elif sub_command.startswith("DROP COLUMN"):
-            column_name = command.upper().split("DROP COLUMN", 1)[1].strip()
-            self.tm.alter_drop_column(table_name, column_name)
+    def _handle_join(self, statement, params, limit, offset):
+        tables = [(statement.table, statement.alias)] + [(join.table, join.alias) for join in statement.joins]
+        where = statement.where.bind(params) if statement.where else None
 
-        elif sub_command.startswith("RENAME COLUMN"):
-            _, old, _, new = command.upper().split()[3:7]
-            self.tm.alter_rename_column(table_name, old, new)
+        with self._transaction([table for table, _ in tables], True) as tx:
+            tx.read_join(tables, statement.joins, where, statement.columns, statement.order_by, limit,
+                         offset)
 
-        else:
-            print("Unsupported ALTER TABLE command.")
-
-    def parse_values(self, values_str):
-        values_str = values_str.strip("()")
-        parts = []
-        val = ""
-        in_quote = False
-
-        for ch in values_str:
-            if ch == "'" and not in_quote:
-                in_quote = True
-            elif ch == "'" and in_quote:
-                in_quote = False
-            elif ch == "," and not in_quote:
-                parts.append(val.strip().strip("'"))
-                val = ""
-            else:
-                val += ch
+    def _handle_update(self, statement, params):
+        with self._transaction([statement.table], False) as tx:
+            tx.update_rows(statement.table, statement.column, bind_value(statement.value, params),
+                           statement.where.bind(params))
 
-        if val:
-            parts.append(val.strip().strip("'"))
+    def _handle_delete(self, statement, params):
+        with self._transaction([statement.table], False) as tx:
+            tx.delete_rows(statement.table, statement.where.bind(params))
 
-        return parts
+    def _handle_alter_table(self, statement):
+        if statement.action == "ADD":
+            self.tm.alter_add_column(statement.table, *statement.args)
 
-    def parse_condition(self, cond_str):
-        col, val = cond_str.split("=", 1)
-        return col.strip(), val.strip().strip("'").strip()
+        elif statement.action == "DROP":
+            self.tm.alter_drop_column(statement.table, *statement.args)
 
+        elif statement.action == "RENAME":
+            self.tm.alter_rename_column(statement.table, *statement.args)
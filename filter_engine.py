@@ -0,0 +1,296 @@
+import copy
+import operator
+import re
+from functools import partial
+from itertools import compress, islice
+from column_store import format_value
+from metrics import METRICS, is_tracing, plan_step
+from parallel import parallel_plan
+from sql_parser import And, Between, ColumnRef, Comparison, InList, Like, Not, Or
+from workspace import COMPARISONS
+
+# Applied as op(constant, value) so partial() can bind the constant and the
+# whole column is compared by map() without a Python-level call per row.
+FLIPPED = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.gt,
+    "<=": operator.ge,
+    ">": operator.lt,
+    ">=": operator.le,
+}
+
+
+NUMBER_RE = re.compile(r"-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+
+def like_pattern(pattern):
+    regex = "".join(".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in pattern)
+    return re.compile(regex, re.DOTALL)
+
+
+class ColumnTest:
+    def __init__(self, column, test, comparison=None):
+        self.column = column
+        self.test = test
+        self.comparison = comparison
+
+    def mask(self, ws):
+        # One flag byte per row id, computed a column at a time; TEXT columns
+        # test each dictionary entry once and then look the flags up by code.
+        base = ws.base[self.column]
+        test = self.test
+        if base.type == "TEXT":
+            hits = bytes(map(bool, map(test, base.dictionary)))
+            flags = bytearray(map(hits.__getitem__, islice(base.codes, ws.base_rows)))
+        elif base.type == "BOOL":
+            flags = bytearray(map(bool, map(test, map(bool, islice(base.values, ws.base_rows)))))
+        else:
+            flags = bytearray(map(bool, map(test, islice(base.values, ws.base_rows))))
+        flags.extend(map(bool, map(test, ws.inserted[self.column])))
+        for rid, row in ws.updated.items():
+            if self.column in row:
+                flags[rid] = bool(test(row[self.column]))
+        return int.from_bytes(flags, "little")
+
+    def matches(self, ws, rid):
+        return bool(self.test(ws.get(self.column, rid)))
+
+
+class ColumnPairTest:
+    # Compares two columns of the same row, as in a.low < a.high.
+    def __init__(self, column, op, other):
+        self.column = column
+        self.op = op
+        self.other = other
+
+    def mask(self, ws):
+        rids = range(ws.base_rows + ws.inserted_count())
+        pairs = zip(ws.values(self.column, rids), ws.values(self.other, rids))
+        return int.from_bytes(bytearray(compare_values(self.op, left, right) for left, right in pairs), "little")
+
+    def matches(self, ws, rid):
+        return compare_values(self.op, ws.get(self.column, rid), ws.get(self.other, rid))
+
+
+def compare_values(op, left, right):
+    # TEXT compared with a number is compared as text, as join keys are.
+    if isinstance(left, str) != isinstance(right, str):
+        left, right = format_value(left), format_value(right)
+    return COMPARISONS[op](left, right)
+
+
+class AndFilter:
+    def __init__(self, parts):
+        self.parts = parts
+
+    def mask(self, ws):
+        result = self.parts[0].mask(ws)
+        for part in self.parts[1:]:
+            if not result:
+                break
+            result &= part.mask(ws)
+        return result
+
+    def matches(self, ws, rid):
+        return all(part.matches(ws, rid) for part in self.parts)
+
+
+class OrFilter:
+    def __init__(self, parts):
+        self.parts = parts
+
+    def mask(self, ws):
+        result = 0
+        for part in self.parts:
+            result |= part.mask(ws)
+        return result
+
+    def matches(self, ws, rid):
+        return any(part.matches(ws, rid) for part in self.parts)
+
+
+class NotFilter:
+    def __init__(self, operand):
+        self.operand = operand
+
+    def mask(self, ws):
+        return self.operand.mask(ws) ^ _all_rows(ws)
+
+    def matches(self, ws, rid):
+        return not self.operand.matches(ws, rid)
+
+
+def _all_rows(ws):
+    return int.from_bytes(b"\x01" * (ws.base_rows + ws.inserted_count()), "little")
+
+
+def condition_columns(node):
+    if isinstance(node, (And, Or)):
+        return condition_columns(node.left) | condition_columns(node.right)
+    if isinstance(node, Not):
+        return condition_columns(node.operand)
+    if isinstance(node, Comparison) and isinstance(node.value, ColumnRef):
+        return {node.column, node.value.name}
+    return {node.column}
+
+
+def condition_text(node, nested=False):
+    if isinstance(node, (And, Or)):
+        word = "AND" if isinstance(node, And) else "OR"
+        text = f"{condition_text(node.left, True)} {word} {condition_text(node.right, True)}"
+        return f"({text})" if nested else text
+    if isinstance(node, Not):
+        return f"NOT {condition_text(node.operand, True)}"
+    if isinstance(node, Comparison):
+        return f"{node.column} {node.op} {_literal(node.value)}"
+    negated = "NOT " if node.negated else ""
+    if isinstance(node, InList):
+        return f"{node.column} {negated}IN ({', '.join(_literal(v) for v in node.values)})"
+    if isinstance(node, Between):
+        return f"{node.column} {negated}BETWEEN {_literal(node.low)} AND {_literal(node.high)}"
+    return f"{node.column} {negated}LIKE {_literal(node.pattern)}"
+
+
+def _literal(value):
+    if isinstance(value, ColumnRef):
+        return value.name
+    if not isinstance(value, str) or NUMBER_RE.fullmatch(value):
+        return format_value(value)
+    return "'" + value.replace("'", "''") + "'"
+
+
+def rename_columns(node, rename):
+    if isinstance(node, (And, Or)):
+        return type(node)(rename_columns(node.left, rename), rename_columns(node.right, rename))
+    if isinstance(node, Not):
+        return Not(rename_columns(node.operand, rename))
+    renamed = copy.copy(node)
+    renamed.column = rename(node.column)
+    if isinstance(node, Comparison) and isinstance(node.value, ColumnRef):
+        renamed.value = ColumnRef(rename(node.value.name))
+    return renamed
+
+
+def split_conjuncts(node):
+    if isinstance(node, And):
+        return split_conjuncts(node.left) + split_conjuncts(node.right)
+    return [node]
+
+
+def compile_tree(node, leaf_filter):
+    if isinstance(node, And):
+        return AndFilter([compile_tree(node.left, leaf_filter), compile_tree(node.right, leaf_filter)])
+    if isinstance(node, Or):
+        return OrFilter([compile_tree(node.left, leaf_filter), compile_tree(node.right, leaf_filter)])
+    if isinstance(node, Not):
+        return NotFilter(compile_tree(node.operand, leaf_filter))
+    return leaf_filter(node)
+
+
+def compile_condition(node, ws):
+    return compile_tree(node, lambda leaf: compile_leaf(leaf, ws))
+
+
+def compile_leaf(node, ws):
+    column = node.column
+    for name in condition_columns(node):
+        if name not in ws.columns:
+            raise ValueError(f"WHERE column '{name}' does not exist.")
+    return build_leaf(node, partial(ws.convert, column), ws.base[column].type == "TEXT")
+
+
+def build_leaf(node, convert, is_text):
+    column = node.column
+    if isinstance(node, Comparison) and isinstance(node.value, ColumnRef):
+        return ColumnPairTest(column, node.op, node.value.name)
+    if isinstance(node, Comparison):
+        value = convert(node.value)
+        return ColumnTest(column, partial(FLIPPED[node.op], value), Comparison(column, node.op, value))
+    if isinstance(node, InList):
+        test = ColumnTest(column, frozenset(convert(v) for v in node.values).__contains__)
+    elif isinstance(node, Between):
+        low = convert(node.low)
+        high = convert(node.high)
+        test = AndFilter([ColumnTest(column, partial(operator.le, low), Comparison(column, ">=", low)),
+                          ColumnTest(column, partial(operator.ge, high), Comparison(column, "<=", high))])
+    elif isinstance(node, Like):
+        pattern = like_pattern(format_value(node.pattern))
+        if is_text:
+            test = ColumnTest(column, pattern.fullmatch)
+        else:
+            test = ColumnTest(column, lambda value: pattern.fullmatch(format_value(value)))
+    else:
+        raise ValueError("Unsupported WHERE condition.")
+    return NotFilter(test) if node.negated else test
+
+
+def _conjuncts(compiled):
+    if isinstance(compiled, AndFilter):
+        return [leaf for part in compiled.parts for leaf in _conjuncts(part)]
+    return [compiled]
+
+
+def _index_term(ws, parts):
+    # An indexed comparison among the top-level AND terms narrows the rows to
+    # test; the other terms are then checked on those rows only.
+    for i, part in enumerate(parts):
+        comparison = part.comparison if isinstance(part, ColumnTest) else None
+        if comparison is None or comparison.op == "!=":
+            continue
+        column = comparison.column
+        if ws.indexes.get_sorted(column) is None and not (comparison.op == "=" and ws.indexes.get(column)):
+            continue
+        return comparison, parts[:i] + parts[i + 1:]
+    return None, parts
+
+
+def uses_index(ws, compiled):
+    return _index_term(ws, _conjuncts(compiled))[0] is not None
+
+
+def filter_rows(ws, node):
+    compiled = compile_condition(node, ws)
+    detail = f"{ws.table} where {condition_text(node)}" if is_tracing() else ""
+    comparison, rest = _index_term(ws, _conjuncts(compiled))
+    if comparison is not None:
+        with plan_step("Index Scan", f"{ws.table} using {condition_text(comparison)}") as op:
+            rids = ws.find_compare(comparison.column, comparison.op, comparison.value)
+            op.rows = len(rids)
+        METRICS.add("rows.scanned", len(rids))
+        if not rest:
+            return rids
+        with plan_step("Filter", detail) as op:
+            rids = [rid for rid in rids if all(part.matches(ws, rid) for part in rest)]
+            op.rows = len(rids)
+        return rids
+    total = ws.base_rows + ws.inserted_count()
+    METRICS.add("rows.scanned", total)
+    scan = parallel_plan(ws, condition_columns(node))
+    if scan is not None:
+        with plan_step("Parallel Seq Scan", detail and f"{detail} (workers={scan.workers})") as op:
+            flags = scan.scan(node)
+            if flags is not None:
+                # Workers flag the base rows from the table file; rows this
+                # workspace has updated or inserted, and base rows appended
+                # after the file was written, are tested here.
+                METRICS.add("parallel.tasks", scan.workers)
+                flags.extend(compiled.matches(ws, rid) for rid in range(scan.rows, total))
+                for rid in ws.updated:
+                    flags[rid] = compiled.matches(ws, rid)
+                rids = _live_rids(ws, flags, total)
+                op.rows = len(rids)
+                return rids
+    with plan_step("Seq Scan", detail) as op:
+        flags = bytearray(compiled.mask(ws).to_bytes(total, "little"))
+        rids = _live_rids(ws, flags, total)
+        op.rows = len(rids)
+    return rids
+
+
+def _live_rids(ws, flags, total):
+    for rid in ws.deleted:
+        flags[rid] = 0
+    for rid in ws.tombstones:
+        flags[rid] = 0
+    return list(compress(range(total), flags))
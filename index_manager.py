@@ -0,0 +1,292 @@
+from bisect import bisect_left, insort
+
+SORTED_BUCKET_SIZE = 512
+
+
+class HashIndex:
+    def __init__(self, column):
+        self.column = column
+        self.positions = {}
+
+    def build(self, values):
+        self.positions = {val: pos for pos, val in enumerate(values)}
+
+    def lookup(self, value):
+        return self.positions.get(value)
+
+    def add(self, value, pos):
+        self.positions[value] = pos
+
+    def remove(self, value):
+        self.positions.pop(value, None)
+
+    def copy(self):
+        index = HashIndex(self.column)
+        index.positions = dict(self.positions)
+        return index
+
+    def relabeled(self, column):
+        index = HashIndex(column)
+        index.positions = self.positions
+        return index
+
+
+class IndexOverlay:
+    def __init__(self, base):
+        self.column = base.column
+        self.base = base
+        self.added = {}
+        self.removed = set()
+
+    def lookup(self, value):
+        if value in self.added:
+            return self.added[value]
+        if value in self.removed:
+            return None
+        return self.base.lookup(value)
+
+    def add(self, value, pos):
+        self.added[value] = pos
+
+    def remove(self, value):
+        self.added.pop(value, None)
+        self.removed.add(value)
+
+    def merge(self, target=None):
+        target = target if target is not None else self.base
+        if not target.positions and not self.removed:
+            # A load into an empty table: the added keys are the index.
+            target.positions = self.added
+            self.added = {}
+            return
+        for value in self.removed:
+            target.remove(value)
+        for value, pos in self.added.items():
+            target.add(value, pos)
+
+
+class SortedIndex:
+    # Two-level B+-tree: a list of sorted buckets of (key, rid) pairs plus the
+    # largest pair of each bucket. Copies share buckets until they are written.
+    def __init__(self, name, column):
+        self.name = name
+        self.column = column
+        self.buckets = []
+        self.maxes = []
+        self.owned = set()
+
+    def build(self, values):
+        self.load_sorted(sorted(zip(values, range(len(values)))))
+
+    def load_sorted(self, pairs):
+        self.buckets = [pairs[i:i + SORTED_BUCKET_SIZE] for i in range(0, len(pairs), SORTED_BUCKET_SIZE)]
+        self.maxes = [bucket[-1] for bucket in self.buckets]
+        self.owned = {id(bucket) for bucket in self.buckets}
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets)
+
+    def _own(self, i):
+        bucket = self.buckets[i]
+        if id(bucket) not in self.owned:
+            bucket = list(bucket)
+            self.buckets[i] = bucket
+            self.owned.add(id(bucket))
+        return bucket
+
+    def add(self, key, rid):
+        item = (key, rid)
+        if not self.buckets:
+            self.buckets.append([item])
+            self.maxes.append(item)
+            self.owned.add(id(self.buckets[0]))
+            return
+        i = min(bisect_left(self.maxes, item), len(self.buckets) - 1)
+        bucket = self._own(i)
+        insort(bucket, item)
+        self.maxes[i] = bucket[-1]
+        if len(bucket) > 2 * SORTED_BUCKET_SIZE:
+            half = bucket[SORTED_BUCKET_SIZE:]
+            del bucket[SORTED_BUCKET_SIZE:]
+            self.buckets.insert(i + 1, half)
+            self.maxes[i] = bucket[-1]
+            self.maxes.insert(i + 1, half[-1])
+            self.owned.add(id(half))
+
+    def remove(self, key, rid):
+        item = (key, rid)
+        i = bisect_left(self.maxes, item)
+        if i == len(self.buckets):
+            return
+        j = bisect_left(self.buckets[i], item)
+        if j == len(self.buckets[i]) or self.buckets[i][j] != item:
+            return
+        bucket = self._own(i)
+        del bucket[j]
+        if bucket:
+            self.maxes[i] = bucket[-1]
+        else:
+            self.owned.discard(id(bucket))
+            del self.buckets[i]
+            del self.maxes[i]
+
+    def range(self, low=None, high=None, low_inclusive=True, high_inclusive=True, reverse=False):
+        if reverse:
+            yield from self._range_desc(low, high, low_inclusive, high_inclusive)
+            return
+        if low is None:
+            i = j = 0
+        else:
+            item = (low, -1) if low_inclusive else (low, float("inf"))
+            i = bisect_left(self.maxes, item)
+            j = bisect_left(self.buckets[i], item) if i < len(self.buckets) else 0
+        for bucket in self.buckets[i:]:
+            for key, rid in bucket[j:]:
+                if high is not None and (key > high or (key == high and not high_inclusive)):
+                    return
+                yield rid
+            j = 0
+
+    def _range_desc(self, low, high, low_inclusive, high_inclusive):
+        if high is None:
+            i = len(self.buckets) - 1
+            j = len(self.buckets[i]) if self.buckets else 0
+        else:
+            item = (high, float("inf")) if high_inclusive else (high, -1)
+            i = min(bisect_left(self.maxes, item), len(self.buckets) - 1)
+            j = bisect_left(self.buckets[i], item) if i >= 0 else 0
+        while i >= 0:
+            for key, rid in reversed(self.buckets[i][:j]):
+                if low is not None and (key < low or (key == low and not low_inclusive)):
+                    return
+                yield rid
+            i -= 1
+            j = len(self.buckets[i]) if i >= 0 else 0
+
+    def items(self):
+        for bucket in self.buckets:
+            yield from bucket
+
+    def copy(self):
+        index = SortedIndex(self.name, self.column)
+        index.buckets = list(self.buckets)
+        index.maxes = list(self.maxes)
+        return index
+
+
+class TableIndexes:
+    def __init__(self, meta=None):
+        self.indexes = {}
+        self.sorted = {}
+        if meta is None:
+            return
+        if meta.primary_key:
+            self.indexes[meta.primary_key] = HashIndex(meta.primary_key)
+        for key in meta.unique_keys:
+            self.indexes[key] = HashIndex(key)
+        for name, column in meta.indexes.items():
+            self.sorted[name] = SortedIndex(name, column)
+
+    def build(self, data):
+        for col, index in self.indexes.items():
+            if col in data:
+                index.build(data[col])
+
+    def build_sorted(self, data):
+        for index in self.sorted.values():
+            if index.column in data:
+                index.build(data[index.column])
+
+    def get(self, column):
+        return self.indexes.get(column)
+
+    def get_sorted(self, column):
+        for index in self.sorted.values():
+            if index.column == column:
+                return index
+        return None
+
+    def with_sorted(self, sorted_indexes):
+        changed = TableIndexes()
+        changed.indexes = self.indexes
+        changed.sorted = sorted_indexes
+        return changed
+
+    def apply_sorted_changes(self, removed, added, shared):
+        touched = {col for col, _, _ in removed} | {col for col, _, _ in added}
+        if not touched:
+            return self
+        target = self.with_sorted(dict(self.sorted)) if shared else self
+        for name, index in self.sorted.items():
+            if index.column not in touched:
+                continue
+            if shared:
+                index = index.copy()
+                target.sorted[name] = index
+            for col, key, rid in removed:
+                if col == index.column:
+                    index.remove(key, rid)
+            for col, key, rid in added:
+                if col == index.column:
+                    index.add(key, rid)
+        return target
+
+    def check_unique(self, column, value, pos=None):
+        index = self.indexes.get(column)
+        if index is None:
+            return
+        existing = index.lookup(value)
+        if existing is not None and existing != pos:
+            raise ValueError(f"Duplicate value '{value}' in column '{column}'")
+
+    def copy(self):
+        copied = TableIndexes()
+        copied.indexes = {col: index.copy() for col, index in self.indexes.items()}
+        copied.sorted = {name: index.copy() for name, index in self.sorted.items()}
+        return copied
+
+    def overlay(self):
+        overlaid = TableIndexes()
+        overlaid.indexes = {col: IndexOverlay(index) for col, index in self.indexes.items()}
+        overlaid.sorted = self.sorted
+        return overlaid
+
+    def merge(self, target=None):
+        for col, index in self.indexes.items():
+            index.merge(target.get(col) if target is not None else None)
+
+    def copy_columns(self, columns):
+        copied = TableIndexes()
+        copied.indexes = {col: index.copy() if col in columns else index for col, index in self.indexes.items()}
+        copied.sorted = self.sorted
+        return copied
+
+    def reshaped(self, renamed=None, dropped=()):
+        # The same index entries under the columns left by a metadata-only
+        # ALTER TABLE; only indexes on a renamed column get new objects.
+        renamed = renamed or {}
+        changed = TableIndexes()
+        for col, index in self.indexes.items():
+            if col in dropped:
+                continue
+            if col in renamed:
+                col = renamed[col]
+                index = index.relabeled(col)
+            changed.indexes[col] = index
+        for name, index in self.sorted.items():
+            if index.column in dropped:
+                continue
+            if index.column in renamed:
+                column = renamed[index.column]
+                index = index.copy()
+                index.column = column
+            changed.sorted[name] = index
+        return changed
+
+    def rebuilt(self, data):
+        fresh = TableIndexes()
+        fresh.indexes = {col: HashIndex(col) for col in self.indexes}
+        fresh.sorted = {name: SortedIndex(name, index.column) for name, index in self.sorted.items()}
+        fresh.build(data)
+        fresh.build_sorted(data)
+        return fresh
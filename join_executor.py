@@ -0,0 +1,249 @@
+import math
+from functools import reduce
+from itertools import groupby
+from column_store import format_value
+from filter_engine import (compare_values, compile_leaf, compile_tree, condition_columns, condition_text, filter_rows,
+                           rename_columns, split_conjuncts)
+from metrics import METRICS, plan_step
+from sql_parser import And, ColumnRef, Comparison
+
+
+class JoinSource:
+    def __init__(self, alias, ws):
+        self.alias = alias
+        self.ws = ws
+        self.rids = None
+
+    def row_ids(self):
+        return self.ws.row_ids() if self.rids is None else self.rids
+
+    def count(self):
+        return self.ws.row_count() if self.rids is None else len(self.rids)
+
+
+class JoinedTest:
+    def __init__(self, pos, test):
+        self.pos = pos
+        self.test = test
+
+    def matches(self, sources, row):
+        return self.test.matches(sources[self.pos].ws, row[self.pos])
+
+
+class JoinedComparison:
+    # A comparison between columns of two different tables in a joined row.
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def matches(self, sources, row):
+        (left_pos, left_col), (right_pos, right_col) = self.left, self.right
+        return compare_values(self.op, sources[left_pos].ws.get(left_col, row[left_pos]),
+                              sources[right_pos].ws.get(right_col, row[right_pos]))
+
+
+def resolve_column(sources, ref):
+    if "." in ref:
+        alias, column = ref.split(".", 1)
+        found = [pos for pos, source in enumerate(sources) if source.alias == alias]
+        if not found:
+            raise ValueError(f"Unknown table '{alias}' in column '{ref}'.")
+    else:
+        column = ref
+        found = [pos for pos, source in enumerate(sources) if column in source.ws.columns]
+    if len(found) > 1:
+        raise ValueError(f"Column '{ref}' is ambiguous.")
+    if not found or column not in sources[found[0]].ws.columns:
+        raise ValueError(f"Column '{ref}' does not exist.")
+    return found[0], column
+
+
+def output_columns(sources, selected_columns):
+    if selected_columns:
+        return list(selected_columns), [resolve_column(sources, ref) for ref in selected_columns]
+    headers = []
+    columns = []
+    for pos, source in enumerate(sources):
+        for column in source.ws.columns:
+            headers.append(f"{source.alias}.{column}")
+            columns.append((pos, column))
+    return headers, columns
+
+
+def _push_down(sources, condition):
+    # Terms that reference a single table filter that table before the join;
+    # the rest are checked on joined rows.
+    local = {}
+    residual = []
+    for conjunct in split_conjuncts(condition):
+        positions = {resolve_column(sources, ref)[0] for ref in condition_columns(conjunct)}
+        if len(positions) == 1:
+            local.setdefault(positions.pop(), []).append(conjunct)
+        else:
+            residual.append(conjunct)
+    for pos, conjuncts in local.items():
+        node = rename_columns(reduce(And, conjuncts), lambda ref: resolve_column(sources, ref)[1])
+        sources[pos].rids = filter_rows(sources[pos].ws, node)
+    if not residual:
+        return None, None
+
+    def leaf_filter(leaf):
+        pos, column = resolve_column(sources, leaf.column)
+        if isinstance(leaf, Comparison) and isinstance(leaf.value, ColumnRef):
+            other = resolve_column(sources, leaf.value.name)
+            if other[0] != pos:
+                return JoinedComparison(leaf.op, (pos, column), other)
+        renamed = rename_columns(leaf, lambda ref: resolve_column(sources, ref)[1])
+        return JoinedTest(pos, compile_leaf(renamed, sources[pos].ws))
+    residual = reduce(And, residual)
+    return compile_tree(residual, leaf_filter), residual
+
+
+def _key_function(source, column, other_type):
+    ws = source.ws
+    if ws.base[column].type != "TEXT" and other_type == "TEXT":
+        return lambda rid: format_value(ws.get(column, rid))
+    return lambda rid: ws.get(column, rid)
+
+
+def _is_ordered(source, column):
+    return source.ws.indexes.get_sorted(column) is not None and not source.ws.has_changes()
+
+
+def _ordered_rids(source, column):
+    ws = source.ws
+    if _is_ordered(source, column):
+        rids = (rid for rid in ws.indexes.get_sorted(column).range() if rid < ws.base_rows)
+        if source.rids is None:
+            return rids
+        keep = set(source.rids)
+        return (rid for rid in rids if rid in keep)
+    return ws.sort_rows(list(source.row_ids()), column)
+
+
+def choose_join(sources, left, right, estimate):
+    # Rough cost in rows touched: probing an index per left row, building and
+    # probing a hash table, or sorting whichever inputs are not already in
+    # key order and merging them.
+    left_pos, left_col = left
+    right_pos, right_col = right
+    left_source = sources[left_pos]
+    right_source = sources[right_pos]
+    right_rows = right_source.count()
+    costs = {"hash": estimate + right_rows + min(estimate, right_rows)}
+    left_type = left_source.ws.base[left_col].type
+    right_type = right_source.ws.base[right_col].type
+    # An index probe converts the key to the inner column's type, so it is
+    # only used when that leaves the key as it is: the other methods compare
+    # keys of different types as text, and every method must give the same
+    # rows.
+    if left_type == right_type:
+        if right_source.ws.indexes.get(right_col) is not None:
+            costs["index"] = estimate
+        elif right_source.ws.indexes.get_sorted(right_col) is not None:
+            costs["index"] = estimate * math.log2(right_rows + 2)
+    if (left_type == "TEXT") == (right_type == "TEXT"):
+        left_ordered = left_pos == 0 and right_pos == 1 and _is_ordered(left_source, left_col)
+        left_sort = 0 if left_ordered else estimate * math.log2(estimate + 2)
+        right_sort = 0 if _is_ordered(right_source, right_col) else right_rows * math.log2(right_rows + 2)
+        costs["merge"] = left_sort + right_sort + estimate + right_rows
+    return min(costs, key=costs.get)
+
+
+def _index_join(rows, left_key, source, column):
+    keep = set(source.rids) if source.rids is not None else None
+    for row in rows:
+        try:
+            rids = source.ws.find_rows(column, left_key(row))
+        except ValueError:
+            continue
+        for rid in rids:
+            if keep is None or rid in keep:
+                yield row + (rid,)
+
+
+def _hash_join(rows, left_key, right_rids, right_key, build_left):
+    table = {}
+    if build_left:
+        for row in rows:
+            table.setdefault(left_key(row), []).append(row)
+        for rid in right_rids:
+            for row in table.get(right_key(rid), ()):
+                yield row + (rid,)
+        return
+    for rid in right_rids:
+        table.setdefault(right_key(rid), []).append(rid)
+    for row in rows:
+        for rid in table.get(left_key(row), ()):
+            yield row + (rid,)
+
+
+def _merge_join(rows, left_key, right_rids, right_key):
+    right_groups = ((key, list(group)) for key, group in groupby(right_rids, right_key))
+    current = next(right_groups, None)
+    for key, left_group in groupby(rows, left_key):
+        while current is not None and current[0] < key:
+            current = next(right_groups, None)
+        if current is None:
+            return
+        if current[0] == key:
+            for row in left_group:
+                for rid in current[1]:
+                    yield row + (rid,)
+
+
+JOIN_NAMES = {"index": "Index Nested Loop Join", "hash": "Hash Join", "merge": "Merge Join"}
+
+
+def execute_join(sources, joins, condition=None):
+    residual, residual_node = _push_down(sources, condition) if condition is not None else (None, None)
+    METRICS.add("rows.scanned", sum(source.count() for source in sources))
+    rows = ((rid,) for rid in sources[0].row_ids())
+    estimate = sources[0].count()
+    for i, join in enumerate(joins, 1):
+        visible = sources[:i + 1]
+        left = resolve_column(visible, join.left_column)
+        right = resolve_column(visible, join.right_column)
+        if left[0] == i:
+            left, right = right, left
+        if right[0] != i or left[0] == i:
+            raise ValueError(f"JOIN condition must compare '{join.alias}' with an earlier table.")
+        rows = _join_step(sources, rows, left, right, estimate)
+        estimate = max(estimate, sources[i].count())
+    if residual is not None:
+        op = plan_step("Filter", condition_text(residual_node))
+        rows = op.track(row for row in rows if residual.matches(sources, row))
+    return rows
+
+
+def _join_step(sources, rows, left, right, estimate):
+    left_pos, left_col = left
+    right_pos, right_col = right
+    source = sources[right_pos]
+    method = choose_join(sources, left, right, estimate)
+    op = plan_step(JOIN_NAMES[method], f"{sources[left_pos].alias}.{left_col} = {source.alias}.{right_col}")
+    with op:
+        rows = _run_join(sources, rows, left, right, estimate, method)
+    return op.track(rows)
+
+
+def _run_join(sources, rows, left, right, estimate, method):
+    left_pos, left_col = left
+    right_pos, right_col = right
+    source = sources[right_pos]
+    left_ws = sources[left_pos].ws
+    if method == "index":
+        return _index_join(rows, lambda row: left_ws.get(left_col, row[left_pos]), source, right_col)
+    left_type = left_ws.base[left_col].type
+    right_type = source.ws.base[right_col].type
+    left_rid_key = _key_function(sources[left_pos], left_col, right_type)
+    left_key = lambda row: left_rid_key(row[left_pos])
+    right_key = _key_function(source, right_col, left_type)
+    if method == "hash":
+        return _hash_join(rows, left_key, source.row_ids(), right_key, estimate < source.count())
+    if not (left_pos == 0 and right_pos == 1 and _is_ordered(sources[0], left_col)):
+        rows = sorted(rows, key=left_key)
+    else:
+        rows = ((rid,) for rid in _ordered_rids(sources[0], left_col))
+    return _merge_join(rows, left_key, _ordered_rids(source, right_col), right_key)
@@ -0,0 +1,83 @@
+import argparse
+import random
+import threading
+import time
+from client import ConnectionPool
+from protocol import DEFAULT_ADDRESS
+
+LOAD_TABLE = "loadgen"
+PRELOAD_BATCH = 500
+
+
+def prepare(pool, rows):
+    pool.execute(f"DROP TABLE {LOAD_TABLE}")
+    pool.execute(f"CREATE TABLE {LOAD_TABLE} (id INT, value INT, PRIMARY KEY(id))")
+    for start in range(0, rows, PRELOAD_BATCH):
+        values = ", ".join(f"({i}, {i % 100})" for i in range(start, min(rows, start + PRELOAD_BATCH)))
+        pool.execute(f"INSERT INTO {LOAD_TABLE} VALUES {values}")
+
+
+def statements(workload, rows, client, requests):
+    rng = random.Random(client)
+    for i in range(requests):
+        if workload == "read" or (workload == "mixed" and rng.random() < 0.8):
+            yield f"SELECT * FROM {LOAD_TABLE} WHERE id = ?", (rng.randrange(rows),)
+        else:
+            yield f"INSERT INTO {LOAD_TABLE} VALUES (?, ?)", (rows + client * requests + i, i % 100)
+
+
+def run_load(pool, clients, requests, workload, rows):
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+    ready = threading.Barrier(clients + 1)
+
+    def worker(client):
+        with pool.connection() as conn:
+            ready.wait()
+            timings = latencies[client]
+            for sql, params in statements(workload, rows, client, requests):
+                start = time.perf_counter()
+                try:
+                    conn.execute(sql, params)
+                except Exception:
+                    errors[client] += 1
+                timings.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in range(clients)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return sorted(t for timings in latencies for t in timings), sum(errors), elapsed
+
+
+def percentile(latencies, fraction):
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate load against a database server.")
+    parser.add_argument("address", nargs="?", default=DEFAULT_ADDRESS)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=1000, help="requests per client")
+    parser.add_argument("--rows", type=int, default=10000, help="rows preloaded into the test table")
+    parser.add_argument("--workload", choices=("read", "write", "mixed"), default="mixed")
+    args = parser.parse_args()
+
+    pool = ConnectionPool(args.address, args.clients)
+    prepare(pool, args.rows)
+    latencies, errors, elapsed = run_load(pool, args.clients, args.requests, args.workload, args.rows)
+    pool.close()
+    print(f"{len(latencies)} requests from {args.clients} clients in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed:.0f} req/s, {errors} errors)")
+    print(f"latency p50 {percentile(latencies, 0.5) * 1000:.2f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,19 @@
+import argparse
 from database_cli import DatabaseCLI
+from protocol import DEFAULT_ADDRESS
 
 if __name__ == '__main__':
-    cli = DatabaseCLI()
-    cli.start()
+    parser = argparse.ArgumentParser(description="MiniDatabase")
+    parser.add_argument("--serve", nargs="?", const=DEFAULT_ADDRESS, metavar="ADDRESS",
+                        help="run as a server on host:port or a Unix socket path")
+    args = parser.parse_args()
+    if args.serve:
+        from server import DatabaseServer
+        server = DatabaseServer(args.serve)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("Server stopped.")
+    else:
+        cli = DatabaseCLI()
+        cli.start()
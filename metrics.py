@@ -0,0 +1,169 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    # Process-wide counters and timings. Call sites do a single flag check
+    # when disabled, so instrumentation can stay in the hot paths.
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timings = {}
+
+    def add(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                self.timings[name] = [1, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                timing[2] = max(timing[2], seconds)
+
+    def timer(self, name):
+        return Timer(self, name) if self.enabled else NULL_TIMER
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.timings.clear()
+
+    def snapshot(self):
+        with self.lock:
+            values = dict(self.counters)
+            for name, (count, total, longest) in self.timings.items():
+                values[f"{name}.count"] = count
+                values[f"{name}.total_ms"] = round(total * 1000, 3)
+                values[f"{name}.max_ms"] = round(longest * 1000, 3)
+        return dict(sorted(values.items()))
+
+    def dump(self, extra=None):
+        values = self.snapshot()
+        values.update(extra or {})
+        return json.dumps({"enabled": self.enabled, "metrics": values}, sort_keys=True)
+
+
+class Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_TIMER = NullTimer()
+METRICS = Metrics()
+
+
+class Operator:
+    # One plan step of a traced statement. Eager steps time themselves as a
+    # context manager; lazy ones wrap their row stream with track(), so their
+    # time includes the inputs they pull from.
+    def __init__(self, trace, name, detail, depth):
+        self.trace = trace
+        self.name = name
+        self.detail = detail
+        self.depth = depth
+        self.rows = None
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.trace.depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds += time.perf_counter() - self.start
+        self.trace.depth -= 1
+
+    def track(self, rows):
+        self.rows = 0
+        rows = iter(rows)
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            try:
+                row = next(rows)
+            except StopIteration:
+                self.seconds += clock() - start
+                return
+            self.seconds += clock() - start
+            self.rows += 1
+            yield row
+
+
+class NullOperator:
+    name = detail = rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+    def track(self, rows):
+        return rows
+
+
+NULL_OPERATOR = NullOperator()
+
+
+class Trace:
+    def __init__(self):
+        self.operators = []
+        self.depth = 0
+
+    def operator(self, name, detail=""):
+        op = Operator(self, name, detail, self.depth)
+        self.operators.append(op)
+        return op
+
+
+_local = threading.local()
+
+
+def plan_step(name, detail=""):
+    trace = getattr(_local, "trace", None)
+    return NULL_OPERATOR if trace is None else trace.operator(name, detail)
+
+
+def is_tracing():
+    return getattr(_local, "trace", None) is not None
+
+
+@contextmanager
+def tracing():
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace = Trace()
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
@@ -0,0 +1,40 @@
+import io
+import sys
+import threading
+from contextlib import contextmanager
+
+_install_lock = threading.Lock()
+
+
+class ThreadOutput:
+    # Stands in for sys.stdout so print() output from one thread can be
+    # captured (a server session, an EXPLAIN) while other threads keep
+    # printing to the real stream.
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+@contextmanager
+def captured_output():
+    with _install_lock:
+        if not isinstance(sys.stdout, ThreadOutput):
+            sys.stdout = ThreadOutput(sys.stdout)
+        output = sys.stdout
+    previous = getattr(output.local, "buffer", None)
+    buffer = io.StringIO()
+    output.local.buffer = buffer
+    try:
+        yield buffer
+    finally:
+        output.local.buffer = previous
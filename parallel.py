@@ -0,0 +1,196 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from itertools import compress
+from multiprocessing import get_context
+from column_store import TYPECODES, convert_value
+from storage import MappedColumn, TableFile
+from workspace import take
+
+CHUNK_ROWS = 1 << 18
+
+_max_workers = os.cpu_count() or 1
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+# Worker side: table files opened by this process, by path.
+_files = {}
+
+
+class ChangedFileError(Exception):
+    pass
+
+
+def max_workers():
+    return _max_workers
+
+
+def set_max_workers(workers):
+    # 0 restores the default of one worker per core; 1 runs every query serially.
+    global _max_workers
+    _max_workers = workers if workers > 0 else os.cpu_count() or 1
+
+
+def degree_for(rows):
+    # One worker per chunk up to the worker limit, so small tables stay serial.
+    return min(_max_workers, -(-rows // CHUNK_ROWS))
+
+
+def _executor():
+    global _pool, _pool_workers
+    workers = _max_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(workers, mp_context=get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def _reset(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+
+
+def _ranges(rows, degree):
+    # Contiguous row ranges of whole chunks, one per worker, in row order.
+    chunks = -(-rows // CHUNK_ROWS)
+    bounds = [min(rows, chunks * i // degree * CHUNK_ROWS) for i in range(degree + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+class ParallelPlan:
+    def __init__(self, table_file, names, rows, ranges):
+        self.table_file = table_file
+        self.names = names
+        self.rows = rows
+        self.ranges = ranges
+        self.workers = len(ranges)
+
+    def scan(self, node):
+        # Match flags for the base rows, one byte per row, joined in row order.
+        parts = self._run(partial(_scan_range, node))
+        return None if parts is None else bytearray(b"".join(parts))
+
+    def aggregate(self, node, group_by, aggregates):
+        # Partial aggregate states from each worker, in row order.
+        return self._run(partial(_aggregate_range, node, tuple(group_by), tuple(aggregates)))
+
+    def _run(self, task):
+        pool = _executor()
+        task = partial(task, self.table_file.path, self.table_file.identity, self.names)
+        try:
+            return list(pool.map(task, *zip(*self.ranges)))
+        except ChangedFileError:
+            return None
+        except BrokenProcessPool:
+            _reset(pool)
+            return None
+
+
+def parallel_plan(ws, columns):
+    # Workers map the table file themselves, so every column they read must
+    # come from the same file and be unchanged since it was read. They scan
+    # the base rows the file holds (plan.rows); rows appended since are left
+    # to the caller. Returns None when the query should run serially.
+    table_file = None
+    names = {}
+    rows = ws.base_rows
+    for col in columns:
+        column = ws.base[col]
+        source = column.table_file if isinstance(column, MappedColumn) else None
+        if source is None or (table_file is not None and source is not table_file):
+            return None
+        table_file = source
+        names[col] = (column.name, column.type)
+        rows = min(rows, column.rows)
+    if table_file is None:
+        return None
+    degree = degree_for(rows)
+    if degree < 2:
+        return None
+    return ParallelPlan(table_file, names, rows, _ranges(rows, degree))
+
+
+class RangeView:
+    # The rows of a table file one worker filters: enough of a workspace for
+    # compiled conditions and batched value reads. TEXT tests run once per
+    # dictionary entry, so a worker masks its whole range in one pass.
+    def __init__(self, table_file, names, start, stop):
+        self.base = {col: _range_column(table_file, name, col_type, start, stop)
+                     for col, (name, col_type) in names.items()}
+        self.base_rows = stop - start
+        self.inserted = {col: () for col in names}
+        self.updated = {}
+
+    def inserted_count(self):
+        return 0
+
+    def values(self, column, rids):
+        base = self.base[column]
+        if base.type == "TEXT":
+            return list(map(base.dictionary.__getitem__, take(base.codes, rids)))
+        values = take(base.values, rids)
+        return list(map(bool, values)) if base.type == "BOOL" else values
+
+
+class RangeColumn:
+    def __init__(self, col_type, values=None, codes=None, dictionary=None):
+        self.type = col_type
+        self.values = values
+        self.codes = codes
+        self.dictionary = dictionary
+
+
+def _open_file(path, identity):
+    table_file = _files.get(path)
+    if table_file is None or table_file.identity != identity:
+        if table_file is not None:
+            table_file.close()
+        table_file = _files[path] = TableFile(path)
+    if table_file.identity != identity:
+        raise ChangedFileError(path)
+    return table_file
+
+
+def _range_column(table_file, name, col_type, start, stop):
+    # Values are read in place from the mapped pages, not copied or pickled.
+    entry = table_file.directory[name]
+    segment = memoryview(table_file.mm)[entry["offset"]:entry["offset"] + entry["bytes"]]
+    if col_type == "TEXT":
+        return RangeColumn(col_type, codes=segment.cast("i")[start:stop],
+                           dictionary=table_file.read_dictionary(name))
+    return RangeColumn(col_type, values=segment.cast(TYPECODES[col_type])[start:stop])
+
+
+def _compile(node, names):
+    from filter_engine import build_leaf, compile_tree
+
+    def leaf_filter(leaf):
+        col_type = names[leaf.column][1]
+        return build_leaf(leaf, partial(convert_value, col_type), col_type == "TEXT")
+    return compile_tree(node, leaf_filter)
+
+
+def _scan_range(node, path, identity, names, start, stop):
+    view = RangeView(_open_file(path, identity), names, start, stop)
+    return _compile(node, names).mask(view).to_bytes(view.base_rows, "little")
+
+
+def _aggregate_range(node, group_by, aggregates, path, identity, names, start, stop):
+    from aggregate import HashAggregator, add_rows, column_types
+    view = RangeView(_open_file(path, identity), names, start, stop)
+    if node is None:
+        positions = range(view.base_rows)
+    else:
+        flags = _compile(node, names).mask(view).to_bytes(view.base_rows, "little")
+        positions = compress(range(view.base_rows), flags)
+    aggregator = HashAggregator(aggregates, column_types(view))
+    add_rows(aggregator, view, positions, group_by, aggregates)
+    return list(aggregator.states())
@@ -0,0 +1,47 @@
+import json
+import socket
+import struct
+
+DEFAULT_ADDRESS = "127.0.0.1:7878"
+HEADER = struct.Struct("!I")
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+
+def parse_address(address):
+    # "host:port" is TCP; anything else is a Unix socket path.
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+
+def send_message(sock, message):
+    payload = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def recv_message(sock):
+    header = _recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > MAX_MESSAGE_BYTES:
+        raise ValueError(f"Message of {length} bytes is too large.")
+    payload = _recv_exact(sock, length)
+    if payload is None:
+        raise ConnectionError("Connection closed in the middle of a message.")
+    return json.loads(payload)
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            if received:
+                raise ConnectionError("Connection closed in the middle of a message.")
+            return None
+        received += count
+    return bytes(buffer)
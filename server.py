@@ -0,0 +1,81 @@
+import os
+import socket
+import socketserver
+import threading
+from database_cli import DatabaseCLI
+from output import captured_output
+from protocol import DEFAULT_ADDRESS, parse_address, recv_message, send_message
+from sql_parser import PlanCache
+from table_manager import TableManager
+
+
+class SessionHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        if self.server.address_family == socket.AF_INET:
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        db = self.server.db
+        cli = DatabaseCLI(db.tm, db.plans)
+        try:
+            while True:
+                request = recv_message(self.request)
+                if request is None:
+                    break
+                send_message(self.request, db.execute(cli, request))
+        except (OSError, ValueError):
+            pass
+        finally:
+            cli.close()
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class DatabaseServer:
+    # One thread per connection, each with its own session, all sharing one
+    # TableManager and plan cache.
+    def __init__(self, address=DEFAULT_ADDRESS, tm=None):
+        self.tm = tm if tm is not None else TableManager()
+        self.plans = PlanCache()
+        family, target = parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(target):
+                os.remove(target)
+            self.server = ThreadingUnixServer(target, SessionHandler)
+        else:
+            self.server = ThreadingTCPServer(target, SessionHandler)
+        self.server.db = self
+        self.address = address
+
+    def execute(self, cli, request):
+        # print() output of the statement becomes the response body.
+        with captured_output() as output:
+            try:
+                cli.execute_command(request["sql"], request.get("params") or ())
+                error = None
+            except Exception as e:
+                error = str(e)
+        return {"ok": error is None, "output": output.getvalue(), "error": error,
+                "in_transaction": cli.session is not None}
+
+    def serve_forever(self):
+        print(f"Serving on {self.address}.")
+        self.server.serve_forever()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.server.address_family == socket.AF_UNIX and os.path.exists(self.server.server_address):
+            os.remove(self.server.server_address)
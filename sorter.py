@@ -0,0 +1,110 @@
+import heapq
+import pickle
+import tempfile
+from itertools import islice
+from operator import itemgetter
+from metrics import METRICS, plan_step
+
+SORT_MEMORY_ROWS = 1000000
+SORT_BATCH_SIZE = 65536
+RUN_BLOCK_ROWS = 4096
+
+
+class Descending:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __getstate__(self):
+        return self.value
+
+    def __setstate__(self, value):
+        self.value = value
+
+
+def _key_builder(descending):
+    # Returns a function from per-column value lists to sort keys, plus the
+    # reverse flag to sort them with. Only mixed directions need wrapping.
+    if len(descending) == 1:
+        return itemgetter(0), descending[0]
+    if all(descending) or not any(descending):
+        return lambda columns: list(zip(*columns)), descending[0]
+
+    def build(columns):
+        return list(zip(*[list(map(Descending, col)) if desc else col for col, desc in zip(columns, descending)]))
+    return build, False
+
+
+def order_text(order_by):
+    return ", ".join(f"{column} DESC" if descending else column for column, descending in order_by)
+
+
+def keyed(items, descending, batch_values, batch_size=SORT_BATCH_SIZE):
+    # batch_values(batch) returns one list of values per ORDER BY column, so
+    # keys are gathered a column at a time rather than row by row.
+    build, reverse = _key_builder(descending)
+
+    def pairs():
+        it = iter(items)
+        while True:
+            batch = list(islice(it, batch_size))
+            if not batch:
+                return
+            yield from zip(build(batch_values(batch)), batch)
+    return pairs(), reverse
+
+
+def sort_keyed(pairs, reverse=False, limit=None, offset=0, memory_rows=SORT_MEMORY_ROWS, detail=""):
+    if limit is not None:
+        with plan_step("Top-K Sort", f"{detail} (heap of {offset + limit})") as op:
+            pick = heapq.nlargest if reverse else heapq.nsmallest
+            rows = [item for _, item in pick(offset + limit, pairs, key=itemgetter(0))[offset:]]
+            op.rows = len(rows)
+        return rows
+    op = plan_step("Sort", detail)
+    return op.track(islice((item for _, item in _sorted_pairs(pairs, reverse, memory_rows, op)), offset, None))
+
+
+def _sorted_pairs(pairs, reverse, memory_rows, op):
+    pairs = iter(pairs)
+    chunk = list(islice(pairs, memory_rows))
+    if len(chunk) < memory_rows:
+        chunk.sort(key=itemgetter(0), reverse=reverse)
+        yield from chunk
+        return
+    runs = []
+    while chunk:
+        chunk.sort(key=itemgetter(0), reverse=reverse)
+        runs.append(_write_run(chunk))
+        chunk = list(islice(pairs, memory_rows))
+    op.name = "External Sort"
+    op.detail = f"{op.detail} ({len(runs)} runs)"
+    METRICS.add("sort.external_runs", len(runs))
+    yield from heapq.merge(*[_read_run(f) for f in runs], key=itemgetter(0), reverse=reverse)
+
+
+def _write_run(chunk):
+    f = tempfile.TemporaryFile()
+    for start in range(0, len(chunk), RUN_BLOCK_ROWS):
+        pickle.dump(chunk[start:start + RUN_BLOCK_ROWS], f, pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+
+def _read_run(f):
+    try:
+        while True:
+            try:
+                block = pickle.load(f)
+            except EOFError:
+                return
+            yield from block
+    finally:
+        f.close()
@@ -0,0 +1,678 @@
+import re
+import threading
+from collections import OrderedDict
+
+PLAN_CACHE_SIZE = 256
+AGGREGATE_FUNCTIONS = ("COUNT", "SUM", "AVG", "MIN", "MAX")
+COMPARISON_OPS = ("=", "!=", "<>", "<", "<=", ">", ">=")
+KEYWORDS = {
+    "ADD", "ALTER", "ANALYZE", "AND", "AS", "ASC", "BEGIN", "BETWEEN", "BY", "COLUMN", "COMMIT", "COPY",
+    "CREATE", "DEFAULT", "DELETE", "DESC", "DESCRIBE", "DROP", "EXPLAIN", "FROM", "GROUP", "HAVING", "IN",
+    "INDEX", "INNER", "INSERT", "INTO", "JOIN", "JSON", "KEY", "LIKE", "LIMIT", "NOT", "OFF", "OFFSET",
+    "ON", "OR", "ORDER", "PARALLEL", "PRIMARY", "RENAME", "RESET", "ROLLBACK", "SELECT", "SET", "SHOW", "STATS",
+    "TABLE", "TABLES", "TO", "TRANSACTION", "UNIQUE", "UPDATE", "VALUES", "WHERE",
+}
+
+TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^']|'')*')
+      | (?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+      | (?P<name>[A-Za-z_]\w*)
+      | (?P<param>\?)
+      | (?P<op><=|>=|!=|<>|[=<>*,();.])
+    )""", re.VERBOSE)
+
+
+def tokenize(sql):
+    tokens = []
+    pos = 0
+    end = len(sql.rstrip())
+    while pos < end:
+        match = TOKEN_RE.match(sql, pos)
+        if match is None or match.end() == pos:
+            raise ValueError(f"Syntax error near '{sql[pos:].strip()[:20]}'.")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            value = value[1:-1].replace("''", "'")
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+def normalize(tokens):
+    # Names keep their case: whether one is a keyword, a column or a bare
+    # value is only known once parsed, and columns and values are case
+    # sensitive.
+    parts = []
+    for kind, value in tokens:
+        if kind == "string":
+            parts.append("'" + value.replace("'", "''") + "'")
+        else:
+            parts.append(value)
+    return " ".join(parts)
+
+
+class Param:
+    def __init__(self, index):
+        self.index = index
+
+
+class ColumnRef:
+    # A qualified column on the right of a comparison, as in a.id < b.id.
+    def __init__(self, name):
+        self.name = name
+
+
+def bind_value(value, params):
+    return params[value.index] if isinstance(value, Param) else value
+
+
+class Statement:
+    param_count = 0
+
+
+class CreateTable(Statement):
+    def __init__(self, table, columns, column_types, primary_key, unique_keys):
+        self.table = table
+        self.columns = columns
+        self.column_types = column_types
+        self.primary_key = primary_key
+        self.unique_keys = unique_keys
+
+
+class DropTable(Statement):
+    def __init__(self, table):
+        self.table = table
+
+
+class CreateIndex(Statement):
+    def __init__(self, name, table, column):
+        self.name = name
+        self.table = table
+        self.column = column
+
+
+class DropIndex(Statement):
+    def __init__(self, name, table=None):
+        self.name = name
+        self.table = table
+
+
+class ShowTables(Statement):
+    pass
+
+
+class ShowStats(Statement):
+    def __init__(self, as_json=False):
+        self.as_json = as_json
+
+
+class SetStats(Statement):
+    def __init__(self, enabled):
+        self.enabled = enabled
+
+
+class SetParallel(Statement):
+    def __init__(self, workers):
+        self.workers = workers
+
+
+class ResetStats(Statement):
+    pass
+
+
+class Explain(Statement):
+    def __init__(self, statement, analyze=False):
+        self.statement = statement
+        self.analyze = analyze
+
+
+class Describe(Statement):
+    def __init__(self, table):
+        self.table = table
+
+
+class AlterTable(Statement):
+    def __init__(self, table, action, args):
+        self.table = table
+        self.action = action
+        self.args = args
+
+
+class Insert(Statement):
+    def __init__(self, table, rows):
+        self.table = table
+        self.rows = rows
+
+
+class Begin(Statement):
+    pass
+
+
+class Commit(Statement):
+    pass
+
+
+class Rollback(Statement):
+    pass
+
+
+class Copy(Statement):
+    def __init__(self, table, direction, path):
+        self.table = table
+        self.direction = direction
+        self.path = path
+
+
+class Select(Statement):
+    def __init__(self, table, columns, where=None, order_by=None, limit=None, offset=None):
+        self.table = table
+        self.alias = table
+        self.columns = columns
+        self.joins = []
+        self.where = where
+        self.group_by = []
+        self.having = None
+        self.aggregates = []
+        self.order_by = order_by or []
+        self.limit = limit
+        self.offset = offset
+
+
+class Aggregate:
+    def __init__(self, function, column=None):
+        self.function = function
+        self.column = column
+        self.label = f"{function}({column or '*'})"
+        self.alias = None
+
+
+class Join:
+    def __init__(self, table, alias, left_column, right_column):
+        self.table = table
+        self.alias = alias
+        self.left_column = left_column
+        self.right_column = right_column
+
+
+class Update(Statement):
+    def __init__(self, table, column, value, where):
+        self.table = table
+        self.column = column
+        self.value = value
+        self.where = where
+
+
+class Delete(Statement):
+    def __init__(self, table, where):
+        self.table = table
+        self.where = where
+
+
+class Comparison:
+    def __init__(self, column, op, value):
+        self.column = column
+        self.op = op
+        self.value = value
+
+    def bind(self, params):
+        return Comparison(self.column, self.op, bind_value(self.value, params))
+
+
+class InList:
+    def __init__(self, column, values, negated=False):
+        self.column = column
+        self.values = values
+        self.negated = negated
+
+    def bind(self, params):
+        return InList(self.column, [bind_value(v, params) for v in self.values], self.negated)
+
+
+class Between:
+    def __init__(self, column, low, high, negated=False):
+        self.column = column
+        self.low = low
+        self.high = high
+        self.negated = negated
+
+    def bind(self, params):
+        return Between(self.column, bind_value(self.low, params), bind_value(self.high, params), self.negated)
+
+
+class Like:
+    def __init__(self, column, pattern, negated=False):
+        self.column = column
+        self.pattern = pattern
+        self.negated = negated
+
+    def bind(self, params):
+        return Like(self.column, bind_value(self.pattern, params), self.negated)
+
+
+class And:
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def bind(self, params):
+        return And(self.left.bind(params), self.right.bind(params))
+
+
+class Or:
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def bind(self, params):
+        return Or(self.left.bind(params), self.right.bind(params))
+
+
+class Not:
+    def __init__(self, operand):
+        self.operand = operand
+
+    def bind(self, params):
+        return Not(self.operand.bind(params))
+
+
+class Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+        self.param_count = 0
+        self.aggregates = []
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty statement.")
+        statement = self._statement()
+        self._accept(";")
+        if self.pos < len(self.tokens):
+            raise ValueError(f"Unexpected '{self.tokens[self.pos][1]}'.")
+        statement.param_count = self.param_count
+        return statement
+
+    def _statement(self):
+        word = self._peek()[1].upper() if self._peek()[0] == "name" else None
+        handler = getattr(self, f"_parse_{word.lower()}", None) if word else None
+        if handler is None:
+            raise ValueError("Unknown command.")
+        self.pos += 1
+        return handler()
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _accept(self, word):
+        kind, value = self._peek()
+        if (kind == "name" and value.upper() == word) or (kind == "op" and value == word):
+            self.pos += 1
+            return True
+        return False
+
+    def _expect(self, word):
+        if not self._accept(word):
+            found = self._peek()[1]
+            raise ValueError(f"Expected {word} but found '{found}'." if found else f"Expected {word}.")
+
+    def _identifier(self):
+        kind, value = self._peek()
+        if kind != "name":
+            raise ValueError(f"Expected a name but found '{value}'." if value else "Expected a name.")
+        self.pos += 1
+        return value
+
+    def _column(self):
+        name = self._identifier()
+        if self._accept("."):
+            return f"{name}.{self._identifier()}"
+        return name
+
+    def _operand(self):
+        kind, value = self._peek()
+        is_call = self.pos + 1 < len(self.tokens) and self.tokens[self.pos + 1] == ("op", "(")
+        if self.aggregates is None or kind != "name" or value.upper() not in AGGREGATE_FUNCTIONS or not is_call:
+            return self._column()
+        self.pos += 2
+        aggregate = Aggregate(value.upper(), None if self._accept("*") else self._column())
+        if aggregate.column is None and aggregate.function != "COUNT":
+            raise ValueError(f"{aggregate.function}(*) is not supported.")
+        self._expect(")")
+        for existing in self.aggregates:
+            if existing.label == aggregate.label:
+                return existing
+        self.aggregates.append(aggregate)
+        return aggregate
+
+    def _alias(self, default):
+        if self._accept("AS"):
+            return self._identifier()
+        kind, value = self._peek()
+        if kind == "name" and value.upper() not in KEYWORDS:
+            self.pos += 1
+            return value
+        return default
+
+    def _value(self):
+        kind, value = self._peek()
+        if kind == "param":
+            self.pos += 1
+            self.param_count += 1
+            return Param(self.param_count - 1)
+        if kind in ("string", "number", "name"):
+            self.pos += 1
+            return value
+        raise ValueError(f"Expected a value but found '{value}'." if value else "Expected a value.")
+
+    def _comparand(self):
+        # A bare name is still read as a value; a qualified one is a column.
+        if self._peek()[0] == "name" and self.tokens[self.pos + 1:self.pos + 2] == [("op", ".")]:
+            return ColumnRef(self._column())
+        return self._value()
+
+    def _condition(self):
+        node = self._conjunction()
+        while self._accept("OR"):
+            node = Or(node, self._conjunction())
+        return node
+
+    def _conjunction(self):
+        node = self._negation()
+        while self._accept("AND"):
+            node = And(node, self._negation())
+        return node
+
+    def _negation(self):
+        if self._accept("NOT"):
+            return Not(self._negation())
+        if self._accept("("):
+            node = self._condition()
+            self._expect(")")
+            return node
+        return self._predicate()
+
+    def _predicate(self):
+        column = self._operand()
+        if isinstance(column, Aggregate):
+            column = column.label
+        kind, op = self._peek()
+        if kind == "op" and op in COMPARISON_OPS:
+            self.pos += 1
+            return Comparison(column, "!=" if op == "<>" else op, self._comparand())
+        negated = self._accept("NOT")
+        if self._accept("IN"):
+            self._expect("(")
+            values = [self._value()]
+            while self._accept(","):
+                values.append(self._value())
+            self._expect(")")
+            return InList(column, values, negated)
+        if self._accept("BETWEEN"):
+            low = self._value()
+            self._expect("AND")
+            return Between(column, low, self._value(), negated)
+        if self._accept("LIKE"):
+            return Like(column, self._value(), negated)
+        raise ValueError(f"Expected a comparison after '{column}'.")
+
+    def _parse_create(self):
+        if self._accept("INDEX"):
+            name = self._identifier()
+            self._expect("ON")
+            table = self._identifier()
+            self._expect("(")
+            column = self._identifier()
+            self._expect(")")
+            return CreateIndex(name, table, column)
+        self._expect("TABLE")
+        table = self._identifier()
+        columns = []
+        column_types = {}
+        primary_key = None
+        unique_keys = set()
+        self._expect("(")
+        while True:
+            if self._accept("PRIMARY"):
+                self._expect("KEY")
+                self._expect("(")
+                primary_key = self._identifier()
+                self._expect(")")
+            elif self._accept("UNIQUE"):
+                self._expect("(")
+                unique_keys.add(self._identifier())
+                self._expect(")")
+            else:
+                column = self._identifier()
+                columns.append(column)
+                column_types[column] = self._identifier().upper() if self._peek()[0] == "name" else "TEXT"
+            if not self._accept(","):
+                break
+        self._expect(")")
+        if not primary_key:
+            raise ValueError("A PRIMARY KEY must be specified for table creation.")
+        return CreateTable(table, columns, column_types, primary_key, unique_keys)
+
+    def _parse_drop(self):
+        if self._accept("INDEX"):
+            name = self._identifier()
+            return DropIndex(name, self._identifier() if self._accept("ON") else None)
+        self._expect("TABLE")
+        return DropTable(self._identifier())
+
+    def _parse_show(self):
+        if self._accept("STATS"):
+            return ShowStats(self._accept("JSON"))
+        self._expect("TABLES")
+        return ShowTables()
+
+    def _parse_set(self):
+        if self._accept("PARALLEL"):
+            kind, value = self._peek()
+            if kind != "number" or not value.isdigit():
+                raise ValueError("SET PARALLEL expects a number of workers.")
+            self.pos += 1
+            return SetParallel(int(value))
+        self._expect("STATS")
+        if self._accept("ON"):
+            return SetStats(True)
+        self._expect("OFF")
+        return SetStats(False)
+
+    def _parse_reset(self):
+        self._expect("STATS")
+        return ResetStats()
+
+    def _parse_explain(self):
+        analyze = self._accept("ANALYZE")
+        if self._peek()[0] == "name" and self._peek()[1].upper() == "EXPLAIN":
+            raise ValueError("EXPLAIN cannot be nested.")
+        return Explain(self._statement(), analyze)
+
+    def _parse_describe(self):
+        return Describe(self._identifier())
+
+    def _parse_alter(self):
+        self._expect("TABLE")
+        table = self._identifier()
+        if self._accept("ADD"):
+            self._accept("COLUMN")
+            column = self._identifier()
+            col_type = "TEXT"
+            if self._peek()[0] == "name" and self._peek()[1].upper() != "DEFAULT":
+                col_type = self._identifier().upper()
+            default = None
+            if self._accept("DEFAULT"):
+                default = self._value()
+                if isinstance(default, Param):
+                    raise ValueError("DEFAULT must be a literal value.")
+            return AlterTable(table, "ADD", (column, col_type, default))
+        if self._accept("DROP"):
+            self._accept("COLUMN")
+            return AlterTable(table, "DROP", (self._identifier(),))
+        if self._accept("RENAME"):
+            self._accept("COLUMN")
+            old = self._identifier()
+            self._expect("TO")
+            return AlterTable(table, "RENAME", (old, self._identifier()))
+        raise ValueError("Unsupported ALTER TABLE command.")
+
+    def _parse_insert(self):
+        self._expect("INTO")
+        table = self._identifier()
+        self._expect("VALUES")
+        rows = [self._row()]
+        while self._accept(","):
+            rows.append(self._row())
+        return Insert(table, rows)
+
+    def _row(self):
+        self._expect("(")
+        values = [self._value()]
+        while self._accept(","):
+            values.append(self._value())
+        self._expect(")")
+        return values
+
+    def _parse_begin(self):
+        self._accept("TRANSACTION")
+        return Begin()
+
+    def _parse_commit(self):
+        self._accept("TRANSACTION")
+        return Commit()
+
+    def _parse_rollback(self):
+        self._accept("TRANSACTION")
+        return Rollback()
+
+    def _parse_copy(self):
+        table = self._identifier()
+        direction = "FROM" if self._accept("FROM") else None
+        if direction is None:
+            self._expect("TO")
+            direction = "TO"
+        if self._peek()[0] not in ("string", "param"):
+            raise ValueError("Expected a quoted file name.")
+        return Copy(table, direction, self._value())
+
+    def _parse_select(self):
+        columns = None
+        if not self._accept("*"):
+            columns = [self._select_item()]
+            while self._accept(","):
+                columns.append(self._select_item())
+        self._expect("FROM")
+        select = Select(self._identifier(), columns)
+        select.alias = self._alias(select.table)
+        while True:
+            if self._accept("INNER"):
+                self._expect("JOIN")
+            elif not self._accept("JOIN"):
+                break
+            table = self._identifier()
+            alias = self._alias(table)
+            self._expect("ON")
+            left = self._column()
+            self._expect("=")
+            select.joins.append(Join(table, alias, left, self._column()))
+        if self._accept("WHERE"):
+            aggregates, self.aggregates = self.aggregates, None
+            select.where = self._condition()
+            self.aggregates = aggregates
+        if self._accept("GROUP"):
+            self._expect("BY")
+            select.group_by = [self._column()]
+            while self._accept(","):
+                select.group_by.append(self._column())
+        if self._accept("HAVING"):
+            select.having = self._condition()
+        if self._accept("ORDER"):
+            self._expect("BY")
+            select.order_by = [self._order_item()]
+            while self._accept(","):
+                select.order_by.append(self._order_item())
+        if self._accept("LIMIT"):
+            select.limit = self._value()
+        if self._accept("OFFSET"):
+            select.offset = self._value()
+        select.aggregates = self.aggregates
+        return select
+
+    def _order_item(self):
+        item = self._operand()
+        column = item.label if isinstance(item, Aggregate) else item
+        if self._accept("DESC"):
+            return column, True
+        self._accept("ASC")
+        return column, False
+
+    def _select_item(self):
+        item = self._operand()
+        if isinstance(item, Aggregate) and self._accept("AS"):
+            item.alias = self._identifier()
+        return item
+
+    def _parse_update(self):
+        table = self._identifier()
+        self._expect("SET")
+        column = self._identifier()
+        self._expect("=")
+        value = self._value()
+        self._expect("WHERE")
+        return Update(table, column, value, self._condition())
+
+    def _parse_delete(self):
+        self._expect("FROM")
+        table = self._identifier()
+        self._expect("WHERE")
+        return Delete(table, self._condition())
+
+
+def parse(sql):
+    return Parser(tokenize(sql)).parse()
+
+
+class PlanCache:
+    # Maps both the exact statement text and its normalized token form to the
+    # parsed statement, so a repeated statement skips tokenizing as well.
+    def __init__(self, capacity=PLAN_CACHE_SIZE):
+        self.capacity = capacity
+        self.plans = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sql):
+        plan = self._lookup(sql)
+        if plan is None:
+            tokens = tokenize(sql)
+            key = normalize(tokens)
+            plan = self._lookup(key)
+            if plan is None:
+                plan = Parser(tokens).parse()
+                self._store(key, plan, miss=True)
+            self._store(sql, plan)
+        return plan
+
+    def _lookup(self, key):
+        with self.lock:
+            plan = self.plans.get(key)
+            if plan is not None:
+                self.plans.move_to_end(key)
+                self.hits += 1
+            return plan
+
+    def _store(self, key, plan, miss=False):
+        with self.lock:
+            if miss:
+                self.misses += 1
+            self.plans[key] = plan
+            self.plans.move_to_end(key)
+            while len(self.plans) > self.capacity:
+                self.plans.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.plans.clear()
@@ -0,0 +1,264 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from column_store import NumericColumn, TextColumn, TYPECODES, convert_value, make_column
+from metrics import METRICS
+
+MAGIC = b"MDBT"
+FORMAT_VERSION = 1
+PAGE_SIZE = 4096
+HEADER = struct.Struct("<4sHHIQQ")
+POINT_READ_FRACTION = 16
+
+
+def _pad(f, page_size):
+    remainder = f.tell() % page_size
+    if remainder:
+        f.write(b"\0" * (page_size - remainder))
+
+
+def _write_segment(f, payload, page_size):
+    offset = f.tell()
+    f.write(payload)
+    _pad(f, page_size)
+    return offset, (f.tell() - offset) // page_size
+
+
+def _compact_text(column, rows):
+    codes = column.codes[:rows]
+    used = sorted(set(codes))
+    if len(used) == len(column.dictionary):
+        return column.dictionary, codes
+    remap = {old: new for new, old in enumerate(used)}
+    dictionary = [column.dictionary[code] for code in used]
+    return dictionary, array("i", map(remap.__getitem__, codes))
+
+
+def write_table_file(path, data, extra=None, page_size=PAGE_SIZE, rows=None):
+    # rows bounds every column, for writers working from a snapshot whose
+    # columns may have grown in place since it was taken.
+    tmp_path = path + ".tmp"
+    row_count = len(next(iter(data.values()))) if data else 0
+    if rows is not None:
+        row_count = rows
+    directory = []
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * page_size)
+        for name, column in data.items():
+            entry = {"name": name, "type": column.type, "rows": row_count}
+            table_file = column.table_file if isinstance(column, MappedColumn) else None
+            if table_file is not None and column.rows == row_count:
+                source = table_file.directory[column.name]
+                mm = table_file.mm
+                if column.type == "TEXT":
+                    start = source["dict_offset"]
+                    blob = mm[start:start + source["dict_bytes"]]
+                    entry["dict_offset"], entry["dict_pages"] = _write_segment(f, blob, page_size)
+                    entry["dict_bytes"] = source["dict_bytes"]
+                    entry["dict_count"] = source["dict_count"]
+                payload = mm[source["offset"]:source["offset"] + source["bytes"]]
+            elif column.type == "TEXT":
+                dictionary, codes = _compact_text(column, row_count)
+                encoded = [value.encode("utf-8") for value in dictionary]
+                lengths = array("I", map(len, encoded))
+                blob = lengths.tobytes() + b"".join(encoded)
+                entry["dict_offset"], entry["dict_pages"] = _write_segment(f, blob, page_size)
+                entry["dict_bytes"] = len(blob)
+                entry["dict_count"] = len(dictionary)
+                payload = codes.tobytes()
+            else:
+                payload = column.values.tobytes()[:row_count * column.values.itemsize]
+            entry["offset"], entry["pages"] = _write_segment(f, payload, page_size)
+            entry["bytes"] = len(payload)
+            directory.append(entry)
+        footer_offset = f.tell()
+        footer = {"columns": directory, "extra": extra or {}}
+        f.write(json.dumps(footer, separators=(",", ":")).encode("utf-8"))
+        METRICS.add("storage.bytes_written", f.tell())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, page_size, row_count, footer_offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class TableFile:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(f.fileno())
+        self.identity = (stat.st_dev, stat.st_ino)
+        magic, version, _, self.page_size, self.row_count, footer_offset = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"'{path}' is not a table file.")
+        footer = json.loads(bytes(self.mm[footer_offset:]).decode("utf-8"))
+        self.directory = {entry["name"]: entry for entry in footer["columns"]}
+        self.columns = [entry["name"] for entry in footer["columns"]]
+        self.extra = footer.get("extra", {})
+        self.readers = {}
+
+    def column_bytes(self, name):
+        entry = self.directory[name]
+        return entry["bytes"] + entry.get("dict_bytes", 0)
+
+    def read_column(self, name):
+        entry = self.directory[name]
+        METRICS.add("storage.bytes_read", self.column_bytes(name))
+        raw = self.mm[entry["offset"]:entry["offset"] + entry["bytes"]]
+        if entry["type"] != "TEXT":
+            column = NumericColumn(entry["type"])
+            column.values = array(TYPECODES[entry["type"]])
+            column.values.frombytes(raw)
+            return column
+        column = TextColumn()
+        column.codes.frombytes(raw)
+        column.dictionary = self.read_dictionary(name)
+        column.lookup = {value: code for code, value in enumerate(column.dictionary)}
+        column.dictionary_bytes = entry["dict_bytes"] + (sys.getsizeof("") + 8) * entry["dict_count"]
+        return column
+
+    def read_value(self, name, pos):
+        # One value straight from the mapped pages, without decoding the column.
+        reader = self.readers.get(name)
+        if reader is None:
+            reader = self.readers[name] = self._value_reader(name)
+        if not 0 <= pos < self.directory[name]["rows"]:
+            raise IndexError("column index out of range")
+        return reader(pos)
+
+    def _value_reader(self, name):
+        entry = self.directory[name]
+        layout = struct.Struct("i" if entry["type"] == "TEXT" else TYPECODES[entry["type"]])
+        unpack, size, mm, offset = layout.unpack_from, layout.size, self.mm, entry["offset"]
+        if entry["type"] == "TEXT":
+            dictionary = self.read_dictionary(name)
+            return lambda pos: dictionary[unpack(mm, offset + pos * size)[0]]
+        if entry["type"] == "BOOL":
+            return lambda pos: bool(unpack(mm, offset + pos * size)[0])
+        return lambda pos: unpack(mm, offset + pos * size)[0]
+
+    def read_dictionary(self, name):
+        entry = self.directory[name]
+        count = entry["dict_count"]
+        blob = self.mm[entry["dict_offset"]:entry["dict_offset"] + entry["dict_bytes"]]
+        lengths = array("I")
+        lengths.frombytes(blob[:4 * count])
+        dictionary = []
+        pos = 4 * count
+        for length in lengths:
+            dictionary.append(blob[pos:pos + length].decode("utf-8"))
+            pos += length
+        return dictionary
+
+    def close(self):
+        self.mm.close()
+
+
+class MappedColumn:
+    # Stands in for a column until it is first touched, so a query only
+    # reads the pages of the columns it uses. The file is kept once the
+    # column is decoded, until a row is changed in place: until then its
+    # first rows are still the file's, and parallel scan workers read them
+    # from there.
+    load_lock = threading.Lock()
+
+    def __init__(self, table_file, name):
+        self.table_file = table_file
+        self.name = name
+        self.type = table_file.directory[name]["type"]
+        self.rows = table_file.directory[name]["rows"]
+        self.column = None
+        self.point_reads = 0
+
+    def load(self):
+        if self.column is None:
+            with MappedColumn.load_lock:
+                if self.column is None:
+                    self.column = self.table_file.read_column(self.name)
+        return self.column
+
+    def __len__(self):
+        return self.rows if self.column is None else len(self.column)
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __getitem__(self, pos):
+        # A few point reads leave the column mapped, so it stays shared with
+        # parallel scan workers; once they add up to a fraction of the rows
+        # the column is decoded, since array reads are cheaper per value.
+        if self.column is None and isinstance(pos, int) and pos >= 0:
+            if self.point_reads * POINT_READ_FRACTION < self.rows:
+                self.point_reads += 1
+                return self.table_file.read_value(self.name, pos)
+        return self.load()[pos]
+
+    def __setitem__(self, pos, value):
+        self.load()[pos] = value
+        self.table_file = None
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    def convert(self, value):
+        return convert_value(self.type, value)
+
+    def memory_bytes(self):
+        if self.column is None:
+            return self.table_file.column_bytes(self.name)
+        return self.column.memory_bytes()
+
+
+def read_table_file(path):
+    table_file = TableFile(path)
+    return {name: MappedColumn(table_file, name) for name in table_file.columns}, table_file.extra
+
+
+def write_index_file(path, index, key_type, lsn):
+    pairs = list(index.items())
+    data = {
+        "key": make_column(key_type, [key for key, _ in pairs]),
+        "rid": make_column("INT", [rid for _, rid in pairs]),
+    }
+    write_table_file(path, data, {"column": index.column, "lsn": lsn})
+
+
+def read_index_file(path, index, lsn):
+    if not os.path.exists(path):
+        return False
+    table_file = TableFile(path)
+    try:
+        if table_file.extra.get("lsn") != lsn or table_file.extra.get("column") != index.column:
+            return False
+        index.load_sorted(list(zip(table_file.read_column("key"), table_file.read_column("rid"))))
+        return True
+    finally:
+        table_file.close()
+
+
+def read_text_table(path, column_types):
+    with open(path, "r") as f:
+        lines = f.readlines()
+    if not lines:
+        return None
+    columns = lines[0].strip().split(",")
+    raw = {col: [] for col in columns}
+    for line in lines[1:]:
+        values = line.strip().split(",")
+        for i, col in enumerate(columns):
+            raw[col].append(values[i] if i < len(values) else "")
+    return {col: make_column(column_types.get(col, "TEXT"), values) for col, values in raw.items()}
+
+
+def convert_text_table(txt_path, tbl_path, column_types, lsn=0):
+    data = read_text_table(txt_path, column_types)
+    if data is None:
+        return False
+    write_table_file(tbl_path, data, {"lsn": lsn})
+    os.remove(txt_path)
+    return True
@@ -1,30 +1,81 @@
 import os
 import threading
+import time
+from collections import OrderedDict
+from catalog import Catalog, TableMetadata, collect_stats, read_meta_file
+from column_store import COLUMN_TYPES, DefaultColumn, convert_value, format_value, make_column
+from index_manager import SortedIndex, TableIndexes
+from metrics import METRICS
+from storage import (TableFile, convert_text_table, read_index_file, read_table_file, write_index_file,
+                     write_table_file)
+from wal import WriteAheadLog, apply_operation
 
 DATA_DIR = "data"
+WAL_FILE = "wal.log"
+WAL_CHECKPOINT_BYTES = 4 * 1024 * 1024
+COMPACTION_ATTEMPTS = 3
+COMPACTION_RETRY_SECONDS = 1.0
+TOMBSTONE_LOCK_SECONDS = 1.0
 
-class TableMetadata:
-    def __init__(self, primary_key, unique_keys):
-        self.primary_key = primary_key
-        self.unique_keys = set(unique_keys)
+class Snapshot:
+    def __init__(self, table, data, indexes, version, row_count, tombstones):
+        self.table = table
+        self.data = data
+        self.indexes = indexes
+        self.version = version
+        self.row_count = row_count
+        self.tombstones = tombstones
 
 class TableManager:
-    def __init__(self):
+    def __init__(self, checkpoint_bytes=WAL_CHECKPOINT_BYTES, memory_budget=None):
         if not os.path.exists(DATA_DIR):
             os.mkdir(DATA_DIR)
-        self.table_data = {}
-        self.table_metadata = {}
+        self.table_data = OrderedDict()
+        self.catalog = Catalog(DATA_DIR)
+        self.table_indexes = {}
+        self.table_versions = {}
+        self.table_row_bytes = {}
+        # Rows installed per table: commits append to columns in place, so
+        # snapshots are bounded by this rather than by the column length.
+        self.table_rows = {}
+        # Row ids deleted since the table was last compacted, per table.
+        self.table_tombstones = {}
+        self.snapshots = {}
         self.table_locks = {}
         self.metadata_lock = threading.Lock()
+        # storage_lock is the latch snapshots are pinned and tables installed
+        # under; it is never held for I/O. commit_lock orders WAL appends with
+        # installs, and checkpoint_lock admits one writer of table files.
+        self.storage_lock = threading.RLock()
+        self.commit_lock = threading.Lock()
+        self.checkpoint_lock = threading.RLock()
+        # LSN of the last commit installed per table, and of the first one
+        # its table file does not hold yet; the WAL keeps records from the
+        # lowest of the latter.
+        self.table_lsns = {}
+        self.unflushed_lsns = {}
+        self.checkpoint_bytes = checkpoint_bytes
+        self.memory_budget = memory_budget
+        self.dirty_tables = set()
+        self.pending_compactions = set()
+        self.compaction_lock = threading.Lock()
+        self.compactor = None
+        self.checkpointer_lock = threading.Lock()
+        self.checkpointer = None
+        self.wal = WriteAheadLog(os.path.join(DATA_DIR, WAL_FILE))
+        self._recover()
+        for table_name, meta in self.catalog.tables.items():
+            if meta.stored is not None:
+                self._schedule_compaction(table_name)
 
     def begin_transaction(self, tables, is_read_only):
         from transaction import Transaction
         return Transaction(self, tables, is_read_only)
 
-    def create_table(self, table_name, columns, primary_key, unique_keys):
+    def create_table(self, table_name, columns, primary_key, unique_keys, column_types=None):
+        column_types = column_types or {}
         with self.metadata_lock:
-            file_path = os.path.join(DATA_DIR, f"{table_name}.txt")
-            if os.path.exists(file_path):
+            if table_name in self.catalog:
                 print("Table already exists.")
                 return
             if primary_key not in columns:
@@ -32,31 +83,41 @@ class TableManager:
             for key in unique_keys:
                 if key not in columns:
                     raise ValueError(f"Unique key '{key}' must be a table column.")
-            with open(file_path, "w") as f:
-                f.write(",".join(columns) + "\n")
-            self.table_data[table_name] = {col: [] for col in columns}
-            meta = TableMetadata(primary_key, unique_keys)
-            self.table_metadata[table_name] = meta
-            self._save_metadata(table_name, meta)
+            for col, col_type in column_types.items():
+                if col_type not in COLUMN_TYPES:
+                    raise ValueError(f"Unknown type '{col_type}' for column '{col}'.")
+            meta = TableMetadata(primary_key, unique_keys, self.wal.last_lsn,
+                                 {col: column_types.get(col, "TEXT") for col in columns})
+            data = {col: make_column(meta.column_type(col)) for col in columns}
+            write_table_file(self._table_path(table_name), data, self._file_extra(meta))
+            self.catalog.put(table_name, meta)
+            with self.storage_lock:
+                self._install_table(table_name, data)
             print(f"Table '{table_name}' created.")
 
     def drop_table(self, table_name):
-        with self.metadata_lock:
-            file_path = os.path.join(DATA_DIR, f"{table_name}.txt")
-            meta_path = os.path.join(DATA_DIR, f"{table_name}.meta.txt")
+        # The table lock waits out writers still holding the table, so none of
+        # them can commit it back after it is gone.
+        with self.get_table_lock(table_name), self.checkpoint_lock, self.metadata_lock:
+            meta = self.catalog.remove(table_name)
+            if meta is None:
+                print("Table not found or could not delete.")
+                return
+            file_path = self._table_path(table_name)
             if os.path.exists(file_path):
                 os.remove(file_path)
-                if os.path.exists(meta_path):
-                    os.remove(meta_path)
-                self.table_data.pop(table_name, None)
-                self.table_metadata.pop(table_name, None)
-                self.table_locks.pop(table_name, None)
-                print(f"Table '{table_name}' deleted.")
-            else:
-                print("Table not found or could not delete.")
+            for index_name in meta.indexes:
+                self._remove_index_file(table_name, index_name)
+            with self.storage_lock:
+                self._unload_table(table_name)
+                self.dirty_tables.discard(table_name)
+                self.table_lsns.pop(table_name, None)
+                self.unflushed_lsns.pop(table_name, None)
+            self.table_locks.pop(table_name, None)
+            print(f"Table '{table_name}' deleted.")
 
     def show_tables(self):
-        tables = [f[:-4] for f in os.listdir(DATA_DIR) if f.endswith(".txt") and not f.endswith(".meta.txt")]
+        tables = self.catalog.names()
         if not tables:
             print("No tables found.")
         else:
@@ -64,117 +125,662 @@ class TableManager:
             for t in tables:
                 print(f"- {t}")
 
+    def create_index(self, table_name, index_name, column):
+        with self.get_table_lock(table_name):
+            data = self.load_table(table_name)
+            if data is None:
+                print("Table not found.")
+                return
+            if column not in data:
+                raise ValueError(f"Column '{column}' does not exist.")
+            meta = self.get_table_metadata(table_name)
+            if index_name in meta.indexes:
+                print(f"Index '{index_name}' already exists.")
+                return
+            with self.checkpoint_lock:
+                self._checkpoint_table(table_name)
+                data, indexes, _, _ = self.get_table_snapshot(table_name)
+                index = SortedIndex(index_name, column)
+                index.build(data[column])
+                write_index_file(self._index_path(table_name, index_name), index,
+                                 meta.column_type(column), meta.checkpoint_lsn)
+                with self.catalog.batch(), self.storage_lock:
+                    meta.indexes[index_name] = column
+                    self.catalog.save()
+                    self._install_table(table_name, data, indexes.with_sorted({**indexes.sorted, index_name: index}))
+        print(f"Index '{index_name}' created on '{table_name}({column})'.")
+
+    def drop_index(self, index_name, table_name=None):
+        if table_name is None:
+            table_name = self.find_index_table(index_name)
+            if table_name is None:
+                print(f"Index '{index_name}' does not exist.")
+                return
+        with self.get_table_lock(table_name):
+            meta = self.get_table_metadata(table_name)
+            if meta is None or index_name not in meta.indexes:
+                print(f"Index '{index_name}' does not exist.")
+                return
+            with self.catalog.batch(), self.storage_lock:
+                del meta.indexes[index_name]
+                self.catalog.save()
+                if table_name in self.table_data:
+                    indexes = self.table_indexes[table_name]
+                    remaining = {name: idx for name, idx in indexes.sorted.items() if name != index_name}
+                    self._install_table(table_name, self.table_data[table_name], indexes.with_sorted(remaining),
+                                        tombstones=self.table_tombstones[table_name])
+            self._remove_index_file(table_name, index_name)
+        print(f"Index '{index_name}' dropped.")
+
+    def find_index_table(self, index_name):
+        for table_name, meta in self.catalog.tables.items():
+            if index_name in meta.indexes:
+                return table_name
+        return None
+
+    def _index_path(self, table_name, index_name):
+        return os.path.join(DATA_DIR, f"{table_name}.{index_name}.idx")
+
+    def _remove_index_file(self, table_name, index_name):
+        path = self._index_path(table_name, index_name)
+        if os.path.exists(path):
+            os.remove(path)
+
     def get_table_lock(self, table):
-        if table not in self.table_locks:
-            self.table_locks[table] = threading.RLock()
-        return self.table_locks[table]
+        lock = self.table_locks.get(table)
+        if lock is None:
+            lock = self.table_locks.setdefault(table, threading.RLock())
+        return lock
 
     def get_table_metadata(self, table_name):
-        if table_name not in self.table_metadata:
-            self._load_metadata(table_name)
-        return self.table_metadata[table_name]
-
-    def _save_metadata(self, table_name, meta):
-        meta_path = os.path.join(DATA_DIR, f"{table_name}.meta.txt")
-        with open(meta_path, "w") as f:
-            f.write(f"PRIMARY_KEY={meta.primary_key}\n")
-            if meta.unique_keys:
-                f.write(f"UNIQUE_KEYS={','.join(meta.unique_keys)}\n")
-
-    def _load_metadata(self, table_name):
-        meta_path = os.path.join(DATA_DIR, f"{table_name}.meta.txt")
-        primary_key = None
-        unique_keys = set()
-        if os.path.exists(meta_path):
-            with open(meta_path, "r") as f:
-                for line in f:
-                    if line.startswith("PRIMARY_KEY="):
-                        primary_key = line.strip().split("=")[1]
-                    elif line.startswith("UNIQUE_KEYS="):
-                        unique_keys.update(line.strip().split("=")[1].split(","))
-        self.table_metadata[table_name] = TableMetadata(primary_key, unique_keys)
-    
+        return self.catalog.get(table_name)
+
+    def load_table(self, table_name):
+        return self.get_table_snapshot(table_name)[0]
+
+    def get_table_snapshot(self, table_name):
+        while True:
+            with self.storage_lock:
+                if table_name in self.table_data:
+                    self.table_data.move_to_end(table_name)
+                    METRICS.add("table_cache.hits")
+                    return (self.table_data[table_name], self.table_indexes[table_name],
+                            self.table_versions[table_name], self.table_tombstones[table_name])
+            METRICS.add("table_cache.misses")
+            with METRICS.timer("table.load"):
+                data = self._read_table_file(table_name)
+                if data is None:
+                    return None, None, 0, frozenset()
+                indexes = self.build_indexes(table_name, data)
+            with self.storage_lock:
+                if table_name not in self.table_data:
+                    self._install_table(table_name, data, indexes)
+
+    def acquire_snapshots(self, tables):
+        # Tables are loaded before the latch is taken, so it is only held to
+        # pin them; one evicted in between is loaded again.
+        while True:
+            loaded = [table_name for table_name in tables if self.get_table_snapshot(table_name)[0] is not None]
+            with self.storage_lock:
+                if any(table_name not in self.table_data for table_name in loaded):
+                    continue
+                snapshots = {}
+                for table_name in loaded:
+                    data, indexes, version, tombstones = self.get_table_snapshot(table_name)
+                    snapshot = Snapshot(table_name, data, indexes, version, self.table_rows[table_name], tombstones)
+                    self.snapshots.setdefault(table_name, []).append(snapshot)
+                    snapshots[table_name] = snapshot
+                return snapshots
+
+    def release_snapshot(self, snapshot):
+        with self.storage_lock:
+            active = self.snapshots.get(snapshot.table, [])
+            if snapshot in active:
+                active.remove(snapshot)
+            if not active:
+                self.snapshots.pop(snapshot.table, None)
+
+    def _is_shared(self, table_name, data):
+        # A schema change installs a new dict over the same column objects,
+        # so sharing is decided by column rather than by dict.
+        columns = {id(column) for column in data.values()}
+        return any(s.data is data or any(id(column) in columns for column in s.data.values())
+                   for s in self.snapshots.get(table_name, []))
+
+    def commit_tables(self, workspaces, logged=True):
+        # The WAL is synced before the latch is taken, so readers only wait
+        # for the merge. Unlogged commits (bulk loads) skip the WAL and write
+        # the table file instead; replacing the file is then the commit point,
+        # which is only atomic for a single table.
+        workspaces = [ws for ws in workspaces if ws.has_changes() and ws.table in self.catalog]
+        logged = logged or len(workspaces) > 1
+        if not logged:
+            for ws in workspaces:
+                self._commit_unlogged(ws)
+            return
+        ops = [op for ws in workspaces for op in ws.to_ops()]
+        with self.commit_lock:
+            lsn = self.wal.append(ops) if ops else None
+            with self.storage_lock:
+                for ws in workspaces:
+                    data, indexes, tombstones = ws.merge(self._is_shared(ws.table, ws.base))
+                    self.dirty_tables.add(ws.table)
+                    self._install_table(ws.table, data, indexes, evict=False, tombstones=tombstones)
+                    if lsn is not None:
+                        self.table_lsns[ws.table] = lsn
+                        self.unflushed_lsns.setdefault(ws.table, lsn)
+                self._evict()
+            wal_bytes = self.wal.size()
+        if wal_bytes >= self.checkpoint_bytes:
+            self._schedule_checkpoint()
+
+    def _commit_unlogged(self, ws):
+        # Merged as if shared, so the installed version is untouched while
+        # the file is written, and installed after it as the file's columns:
+        # readers never see rows that are not durable yet. The transaction
+        # holds the table lock, so deleted rows can be compacted out right
+        # away.
+        with self.checkpoint_lock:
+            data, indexes, tombstones = ws.merge(True)
+            if tombstones:
+                data = _without_rows(data, tombstones)
+                indexes = indexes.rebuilt(data)
+            with self.storage_lock:
+                meta = self.get_table_metadata(ws.table)
+                lsn = self.table_lsns.get(ws.table, meta.checkpoint_lsn)
+            stats = self._write_table(ws.table, meta, data, indexes, lsn)
+            mapped, _ = read_table_file(self._table_path(ws.table))
+            with self.catalog.batch(), self.storage_lock:
+                self._install_table(ws.table, mapped, indexes)
+                self._table_written(ws.table, meta, lsn, stats)
+
+    def _install_table(self, table_name, data, indexes=None, evict=True, tombstones=frozenset()):
+        if indexes is None:
+            indexes = self.build_indexes(table_name, data)
+        if not self.table_row_bytes.get(table_name):
+            self.table_row_bytes[table_name] = _estimate_row_bytes(data)
+        self.table_data[table_name] = data
+        self.table_data.move_to_end(table_name)
+        self.table_indexes[table_name] = indexes
+        rows = len(next(iter(data.values()))) if data else 0
+        self.table_rows[table_name] = rows
+        self.table_tombstones[table_name] = tombstones
+        meta = self.catalog.get(table_name)
+        if meta is not None:
+            meta.row_count = rows - len(tombstones)
+        self.table_versions[table_name] = self.table_versions.get(table_name, 0) + 1
+        if evict:
+            self._evict()
+
+    def _unload_table(self, table_name):
+        self.table_data.pop(table_name, None)
+        self.table_indexes.pop(table_name, None)
+        self.table_row_bytes.pop(table_name, None)
+        self.table_rows.pop(table_name, None)
+        self.table_tombstones.pop(table_name, None)
+
+    def memory_usage(self):
+        with self.storage_lock:
+            return sum(self._table_bytes(t) for t in self.table_data)
+
+    def _table_bytes(self, table_name):
+        data = self.table_data[table_name]
+        rows = len(next(iter(data.values()))) if data else 0
+        return rows * (self.table_row_bytes.get(table_name) or 0)
+
+    def _evict(self):
+        # Dirty tables are only evicted once the background checkpoint has
+        # written them, so it is started when one is in the way.
+        if self.memory_budget is None:
+            return
+        usage = sum(self._table_bytes(t) for t in self.table_data)
+        for table_name in list(self.table_data)[:-1]:
+            if usage <= self.memory_budget:
+                break
+            if table_name in self.dirty_tables:
+                self._schedule_checkpoint()
+                continue
+            usage -= self._table_bytes(table_name)
+            self._unload_table(table_name)
+
+    def checkpoint(self):
+        self._checkpoint()
+
+    def _schedule_checkpoint(self):
+        with self.checkpointer_lock:
+            if self.checkpointer is None:
+                self.checkpointer = threading.Thread(target=self._run_checkpoint, daemon=True)
+                self.checkpointer.start()
+
+    def _run_checkpoint(self):
+        try:
+            self._checkpoint()
+        except Exception as e:
+            print(f"Checkpoint failed: {e}")
+        finally:
+            with self.checkpointer_lock:
+                self.checkpointer = None
+
+    def wait_for_checkpoint(self):
+        with self.checkpointer_lock:
+            checkpointer = self.checkpointer
+        if checkpointer is not None:
+            checkpointer.join()
+
+    def _checkpoint(self):
+        with self.checkpoint_lock, METRICS.timer("checkpoint"):
+            with self.storage_lock:
+                tables = sorted(self.dirty_tables)
+            for table_name in tables:
+                self._checkpoint_table(table_name)
+            # Appends register their LSN under the commit lock, so no record
+            # can be dropped between taking the minimum and truncating.
+            with self.commit_lock:
+                with self.storage_lock:
+                    keep_from = min(self.unflushed_lsns.values(), default=None)
+                self.wal.truncate(keep_from)
+            with self.storage_lock:
+                self._evict()
+
+    def _checkpoint_table(self, table_name):
+        # Writes the table from a pinned snapshot with only the checkpoint
+        # lock held, so reads and commits go on meanwhile. The pin makes
+        # commits copy what they change rather than update it in place; a
+        # table committed to during the write stays dirty.
+        with self.checkpoint_lock:
+            with self.storage_lock:
+                meta = self.get_table_metadata(table_name)
+                if meta is None or table_name not in self.dirty_tables:
+                    self.dirty_tables.discard(table_name)
+                    return
+                data, indexes, version, tombstones = self.get_table_snapshot(table_name)
+                if not tombstones:
+                    snapshot = Snapshot(table_name, data, indexes, version, self.table_rows[table_name], tombstones)
+                    self.snapshots.setdefault(table_name, []).append(snapshot)
+                    lsn = self.table_lsns.get(table_name, meta.checkpoint_lsn)
+                    unflushed = self.unflushed_lsns.pop(table_name, None)
+            if tombstones:
+                self._compact_tombstones(table_name)
+                return
+            try:
+                stats = self._write_table(table_name, meta, data, indexes, lsn, snapshot.row_count)
+            except Exception:
+                with self.storage_lock:
+                    if unflushed is not None:
+                        self.unflushed_lsns[table_name] = min(unflushed, self.unflushed_lsns.get(table_name, unflushed))
+                raise
+            finally:
+                self.release_snapshot(snapshot)
+            mapped, _ = read_table_file(self._table_path(table_name))
+            with self.catalog.batch(), self.storage_lock:
+                self._table_written(table_name, meta, lsn, stats, dirty=self.table_versions.get(table_name) != version)
+                self._remap_table(table_name, version, mapped)
+
+    def _compact_tombstones(self, table_name):
+        # Compacting renumbers the rows, so the table lock is held until the
+        # compacted file is written: no writer holds row ids of the old
+        # layout, and no commit logs one of the new layout before the file
+        # has it. A table whose lock stays busy is left dirty for the next
+        # checkpoint.
+        lock = self.get_table_lock(table_name)
+        if not lock.acquire(timeout=TOMBSTONE_LOCK_SECONDS):
+            return
+        try:
+            with self.storage_lock:
+                data, indexes, _, tombstones = self.get_table_snapshot(table_name)
+            data = _without_rows(data, tombstones)
+            indexes = indexes.rebuilt(data)
+            with self.storage_lock:
+                self._install_table(table_name, data, indexes, evict=False)
+            self._checkpoint_table(table_name)
+        finally:
+            lock.release()
+
+    def _remap_table(self, table_name, version, mapped):
+        # A table unchanged since its file was written is installed over the
+        # file's columns, so parallel scans can read them from there.
+        if self.table_versions.get(table_name) == version:
+            self._install_table(table_name, mapped, self.table_indexes[table_name], evict=False,
+                                tombstones=self.table_tombstones[table_name])
+
+    def _write_table(self, table_name, meta, data, indexes, lsn, rows=None):
+        write_table_file(self._table_path(table_name), data, {"lsn": lsn, "schema": meta.schema_version}, rows=rows)
+        for index_name, index in indexes.sorted.items():
+            write_index_file(self._index_path(table_name, index_name), index,
+                             meta.column_type(index.column), lsn)
+        return collect_stats(data, meta.stats)
+
+    def _table_written(self, table_name, meta, lsn, stats, dirty=False):
+        # Called under the latch and a catalog batch once the file is in place.
+        meta.checkpoint_lsn = lsn
+        meta.stats = stats
+        meta.file_written()
+        self.catalog.save()
+        if not dirty:
+            self.dirty_tables.discard(table_name)
+            self.unflushed_lsns.pop(table_name, None)
+
+    def _table_path(self, table_name):
+        return os.path.join(DATA_DIR, f"{table_name}.tbl")
+
+    def _file_extra(self, meta):
+        return {"lsn": meta.checkpoint_lsn, "schema": meta.schema_version}
+
+    def _load_catalog(self):
+        if self.catalog.exists():
+            self.catalog.load()
+            return
+        # Data directories from before the catalog have a .meta.txt file per
+        # table; their schemas are read once here and the files removed.
+        names = os.listdir(DATA_DIR)
+        meta_files = [name for name in names if name.endswith(".meta.txt")]
+        tables = {name[:-4] for name in names if name.endswith(".tbl")}
+        tables.update(name[:-4] for name in names if name.endswith(".txt") and not name.endswith(".meta.txt"))
+        with self.catalog.batch():
+            for table_name in sorted(tables):
+                meta_path = os.path.join(DATA_DIR, f"{table_name}.meta.txt")
+                meta = read_meta_file(meta_path) if os.path.exists(meta_path) else TableMetadata(None, ())
+                if not self._migrate_text_table(table_name, meta):
+                    continue
+                table_file = TableFile(self._table_path(table_name))
+                try:
+                    meta.column_types = {col: table_file.directory[col]["type"] for col in table_file.columns}
+                    meta.row_count = table_file.row_count
+                    meta.checkpoint_lsn = table_file.extra.get("lsn", meta.checkpoint_lsn)
+                finally:
+                    table_file.close()
+                self.catalog.tables[table_name] = meta
+            self.catalog.save()
+        for name in meta_files:
+            os.remove(os.path.join(DATA_DIR, name))
+
+    def _migrate_text_table(self, table_name, meta):
+        tbl_path = self._table_path(table_name)
+        txt_path = os.path.join(DATA_DIR, f"{table_name}.txt")
+        if os.path.exists(tbl_path):
+            return True
+        if convert_text_table(txt_path, tbl_path, meta.column_types, meta.checkpoint_lsn):
+            print(f"Converted '{table_name}.txt' to binary table format.")
+            return True
+        return False
+
+    def _recover(self):
+        self._load_catalog()
+        records = self.wal.replay()
+        tombstones = {}
+        for record in records:
+            for op in record["ops"]:
+                table_name = op["table"]
+                if table_name not in self.catalog:
+                    continue
+                if table_name not in self.table_data:
+                    self.table_data[table_name] = self._read_table_file(table_name)
+                if record["lsn"] <= self.get_table_metadata(table_name).checkpoint_lsn:
+                    continue
+                self.dirty_tables.add(table_name)
+                self.table_lsns[table_name] = record["lsn"]
+                self.unflushed_lsns.setdefault(table_name, record["lsn"])
+                apply_operation(self.table_data[table_name], op, tombstones.setdefault(table_name, set()))
+        for table_name in self.dirty_tables:
+            data = self.table_data[table_name]
+            if tombstones.get(table_name):
+                data = _without_rows(data, tombstones[table_name])
+            self._install_table(table_name, data, self._fresh_indexes(table_name, data), evict=False)
+        self.wal.open()
+        self._checkpoint()
+        for table_name in list(self.table_data):
+            self._unload_table(table_name)
+
+    def build_indexes(self, table_name, data):
+        meta = self.get_table_metadata(table_name)
+        indexes = TableIndexes(meta)
+        indexes.build(data)
+        for index_name, index in indexes.sorted.items():
+            if not read_index_file(self._index_path(table_name, index_name), index, meta.checkpoint_lsn):
+                index.build(data[index.column])
+        return indexes
+
+    def _fresh_indexes(self, table_name, data):
+        indexes = TableIndexes(self.get_table_metadata(table_name))
+        indexes.build(data)
+        indexes.build_sorted(data)
+        return indexes
+
     def describe_table(self, table_name):
-        if table_name not in self.table_data:
-            self._load_table_to_memory(table_name)
         metadata = self.get_table_metadata(table_name)
-        data = self.table_data.get(table_name)
-        if not data:
+        if metadata is None:
             print("Table not found.")
             return
         print(f"Table: {table_name}")
+        print(f"Rows: {metadata.row_count}")
         print("Columns:")
-        for col in data.keys():
+        for col in metadata.columns():
             flags = []
             if col == metadata.primary_key:
                 flags.append("PRIMARY KEY")
             if col in metadata.unique_keys:
                 flags.append("UNIQUE")
-            print(f" - {col} {' '.join(flags)}")
+            flags.extend(f"{name}={format_value(value)}" for name, value in metadata.stats.get(col, {}).items())
+            print(f" - {col} {metadata.column_type(col)} {' '.join(flags)}")
+        if metadata.indexes:
+            print("Indexes:")
+            for index_name, col in metadata.indexes.items():
+                print(f" - {index_name} ({col})")
 
-    def alter_add_column(self, table_name, column_name):
-        self._load_table_to_memory(table_name)
-        if column_name in self.table_data[table_name]:
-            print(f"Column '{column_name}' already exists.")
-            return
-        self.table_data[table_name][column_name] = [""] * len(next(iter(self.table_data[table_name].values())))
-        self._persist_table(table_name)
+    def alter_add_column(self, table_name, column_name, col_type="TEXT", default=None):
+        with self.get_table_lock(table_name):
+            meta = self.get_table_metadata(table_name)
+            if meta is None:
+                print("Table not found.")
+                return
+            if column_name in meta.column_types:
+                print(f"Column '{column_name}' already exists.")
+                return
+            if col_type not in COLUMN_TYPES:
+                raise ValueError(f"Unknown type '{col_type}' for column '{column_name}'.")
+            value = convert_value(col_type, "" if default is None else default)
+            with self.checkpoint_lock:
+                self._checkpoint_table(table_name)
+                with self.catalog.batch(), self.storage_lock:
+                    meta.schema_changed()
+                    data = self.table_data.get(table_name)
+                    rows = len(next(iter(data.values()))) if data else meta.row_count
+                    column = DefaultColumn(col_type, value, rows)
+                    meta.column_types[column_name] = col_type
+                    meta.defaults[column_name] = value
+                    meta.stats[column_name] = column.stats()
+                    if data is not None:
+                        data = {**data, column_name: column}
+                    self._finish_schema_change(table_name, data, self.table_indexes.get(table_name))
         print(f"Column '{column_name}' added to '{table_name}'.")
 
-
     def alter_drop_column(self, table_name, column_name):
-        self._load_table_to_memory(table_name)
-        if column_name not in self.table_data[table_name]:
-            print(f"Column '{column_name}' does not exist.")
-            return
-        if column_name == self.table_metadata[table_name].primary_key:
-            print("Cannot drop PRIMARY KEY column.")
-            return
-        del self.table_data[table_name][column_name]
-        self.table_metadata[table_name].unique_keys.discard(column_name)
-        self._persist_table(table_name)
-        self._save_metadata(table_name, self.table_metadata[table_name])
+        with self.get_table_lock(table_name):
+            meta = self.get_table_metadata(table_name)
+            if meta is None:
+                print("Table not found.")
+                return
+            if column_name not in meta.column_types:
+                print(f"Column '{column_name}' does not exist.")
+                return
+            if column_name == meta.primary_key:
+                print("Cannot drop PRIMARY KEY column.")
+                return
+            dropped = [index_name for index_name, col in meta.indexes.items() if col == column_name]
+            with self.checkpoint_lock:
+                self._checkpoint_table(table_name)
+                with self.catalog.batch(), self.storage_lock:
+                    meta.schema_changed()
+                    del meta.column_types[column_name]
+                    meta.stored.pop(column_name, None)
+                    meta.defaults.pop(column_name, None)
+                    meta.stats.pop(column_name, None)
+                    meta.unique_keys.discard(column_name)
+                    for index_name in dropped:
+                        del meta.indexes[index_name]
+                    data = self.table_data.get(table_name)
+                    indexes = None
+                    if data is not None:
+                        data = {col: values for col, values in data.items() if col != column_name}
+                        indexes = self.table_indexes[table_name].reshaped(dropped={column_name})
+                    self._finish_schema_change(table_name, data, indexes)
+            for index_name in dropped:
+                self._remove_index_file(table_name, index_name)
         print(f"Column '{column_name}' dropped from '{table_name}'.")
 
-
     def alter_rename_column(self, table_name, old_name, new_name):
-        self._load_table_to_memory(table_name)
-        if old_name not in self.table_data[table_name]:
-            print(f"Column '{old_name}' does not exist.")
-            return
-        if new_name in self.table_data[table_name]:
-            print(f"Column '{new_name}' already exists.")
-            return
-        self.table_data[table_name][new_name] = self.table_data[table_name].pop(old_name)
-        meta = self.table_metadata[table_name]
-        if old_name == meta.primary_key:
-            meta.primary_key = new_name
-        if old_name in meta.unique_keys:
-            meta.unique_keys.remove(old_name)
-            meta.unique_keys.add(new_name)
-        self._persist_table(table_name)
-        self._save_metadata(table_name, meta)
+        with self.get_table_lock(table_name):
+            meta = self.get_table_metadata(table_name)
+            if meta is None:
+                print("Table not found.")
+                return
+            if old_name not in meta.column_types:
+                print(f"Column '{old_name}' does not exist.")
+                return
+            if new_name in meta.column_types:
+                print(f"Column '{new_name}' already exists.")
+                return
+            rename = lambda col: new_name if col == old_name else col
+            with self.checkpoint_lock:
+                self._checkpoint_table(table_name)
+                with self.catalog.batch(), self.storage_lock:
+                    meta.schema_changed()
+                    meta.column_types = {rename(col): t for col, t in meta.column_types.items()}
+                    meta.stored = {rename(col): name for col, name in meta.stored.items()}
+                    meta.defaults = {rename(col): value for col, value in meta.defaults.items()}
+                    meta.stats = {rename(col): s for col, s in meta.stats.items()}
+                    meta.indexes = {name: rename(col) for name, col in meta.indexes.items()}
+                    meta.primary_key = rename(meta.primary_key)
+                    meta.unique_keys = {rename(col) for col in meta.unique_keys}
+                    data = self.table_data.get(table_name)
+                    indexes = None
+                    if data is not None:
+                        data = {rename(col): values for col, values in data.items()}
+                        indexes = self.table_indexes[table_name].reshaped({old_name: new_name})
+                    self._finish_schema_change(table_name, data, indexes)
         print(f"Column '{old_name}' renamed to '{new_name}' in '{table_name}'.")
-        
-    
-    def _persist_table(self, table_name):
-        file_path = os.path.join(DATA_DIR, f"{table_name}.txt")
-        data = self.table_data[table_name]
-        with open(file_path, "w") as f:
-            headers = list(data.keys())
-            f.write(",".join(headers) + "\n")
-            rows = zip(*[data[col] for col in headers])
-            for row in rows:
-                f.write(",".join(row) + "\n")
-
-
-
-    def _load_table_to_memory(self, table_name):
-        file_path = os.path.join(DATA_DIR, f"{table_name}.txt")
-        if not os.path.exists(file_path): return
-        with open(file_path, "r") as f:
-            lines = f.readlines()
-        if not lines: return
-        columns = lines[0].strip().split(",")
-        self.table_data[table_name] = {col: [] for col in columns}
+
+    def _finish_schema_change(self, table_name, data, indexes):
+        # Called under the checkpoint lock, after WAL records in the old
+        # column order were checkpointed, and under a catalog batch and the
+        # latch. The table file is left as it is: the catalog maps the new
+        # schema onto it, and a background compaction rewrites it later.
+        self.catalog.save()
+        if data is not None:
+            self.table_row_bytes.pop(table_name, None)
+            self._install_table(table_name, data, indexes)
+        self._schedule_compaction(table_name)
+
+    def _schedule_compaction(self, table_name):
+        with self.compaction_lock:
+            self.pending_compactions.add(table_name)
+            if self.compactor is None:
+                self.compactor = threading.Thread(target=self._run_compactions, daemon=True)
+                self.compactor.start()
+
+    def _run_compactions(self):
+        attempts = {}
+        while True:
+            with self.compaction_lock:
+                if not self.pending_compactions:
+                    self.compactor = None
+                    return
+                table_name = self.pending_compactions.pop()
+            try:
+                done = self.compact_table(table_name)
+            except Exception as e:
+                print(f"Compaction of '{table_name}' failed: {e}")
+                continue
+            attempts[table_name] = attempts.get(table_name, 0) + 1
+            if not done and attempts[table_name] < COMPACTION_ATTEMPTS:
+                time.sleep(COMPACTION_RETRY_SECONDS)
+                with self.compaction_lock:
+                    self.pending_compactions.add(table_name)
+
+    def wait_for_compactions(self):
+        while True:
+            with self.compaction_lock:
+                compactor = self.compactor
+            if compactor is None:
+                return
+            compactor.join()
+
+    def compact_table(self, table_name):
+        # Rewrites a table file that is behind its schema. The new file is
+        # written from a snapshot with only the checkpoint lock held, so reads
+        # and commits go on meanwhile; columns that are unchanged are copied
+        # from the mapped file as they are. It is only installed if the table
+        # was not changed in the meantime, otherwise the next checkpoint
+        # brings it up to date.
+        with self.checkpoint_lock:
+            meta = self.get_table_metadata(table_name)
+            if meta is None or meta.stored is None:
+                return True
+            if self.get_table_snapshot(table_name)[0] is None:
+                return True
+            with self.storage_lock:
+                data, indexes, version, tombstones = self.get_table_snapshot(table_name)
+                rows = self.table_rows[table_name]
+                lsn = self.table_lsns.get(table_name, meta.checkpoint_lsn)
+                schema_version = meta.schema_version
+            if tombstones:
+                # The table is dirty, and its checkpoint writes the new schema.
+                return True
+            path = self._table_path(table_name)
+            write_table_file(path + ".compact", data, {"lsn": lsn, "schema": schema_version}, rows=rows)
+            index_paths = {}
+            for index_name, index in indexes.sorted.items():
+                index_paths[index_name] = self._index_path(table_name, index_name) + ".compact"
+                write_index_file(index_paths[index_name], index, meta.column_type(index.column), lsn)
+            stats = collect_stats(data, meta.stats)
+            with self.storage_lock:
+                current = (self.catalog.get(table_name) is meta and meta.schema_version == schema_version
+                           and self.table_versions.get(table_name) == version)
+            if not current:
+                for tmp_path in [path + ".compact", *index_paths.values()]:
+                    os.remove(tmp_path)
+                return False
+            # A commit after the check has an LSN past the file's, so the WAL
+            # still holds it and the table stays dirty.
+            os.replace(path + ".compact", path)
+            for index_name, tmp_path in index_paths.items():
+                os.replace(tmp_path, self._index_path(table_name, index_name))
+            mapped, _ = read_table_file(path)
+            with self.catalog.batch(), self.storage_lock:
+                self._table_written(table_name, meta, lsn, stats, dirty=self.table_versions.get(table_name) != version)
+                self._remap_table(table_name, version, mapped)
+        return True
+
+    def _read_table_file(self, table_name):
+        file_path = self._table_path(table_name)
+        if table_name not in self.catalog or not os.path.exists(file_path):
+            return None
+        data, extra = read_table_file(file_path)
+        meta = self.get_table_metadata(table_name)
+        if "lsn" in extra:
+            meta.checkpoint_lsn = extra["lsn"]
+        if meta.stored is None or extra.get("schema", 0) == meta.schema_version:
+            return data
+        rows = len(next(iter(data.values()))) if data else 0
+        columns = {}
+        for col, col_type in meta.column_types.items():
+            name = meta.file_column(col)
+            if name in data:
+                columns[col] = data[name]
+            else:
+                columns[col] = DefaultColumn(col_type, meta.defaults.get(col, convert_value(col_type, "")), rows)
+        return columns
+
+
+def _without_rows(data, rows):
+    return {col: column.without(rows) for col, column in data.items()}
+
+
+def _estimate_row_bytes(data):
+    if not data:
+        return None
+    rows = len(next(iter(data.values())))
+    if rows == 0:
+        return None
+    return sum(col.memory_bytes() for col in data.values()) // rows
 
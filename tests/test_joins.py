@@ -0,0 +1,42 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from database_cli import DatabaseCLI
+
+
+class JoinKeyTypeTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        self.cli = DatabaseCLI()
+
+    def tearDown(self):
+        self.cli.tm.wait_for_checkpoint()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir)
+
+    def run_sql(self, sql):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.cli.execute_command(sql)
+        return out.getvalue().splitlines()
+
+    def test_text_and_int_keys_match_as_text_whatever_the_method(self):
+        self.run_sql("CREATE TABLE a (code TEXT, PRIMARY KEY(code))")
+        self.run_sql("CREATE TABLE b (id INT, PRIMARY KEY(id))")
+        self.run_sql("INSERT INTO a VALUES ('01'), ('2')")
+        self.run_sql("INSERT INTO b VALUES (1), (2)")
+        query = "SELECT a.code, b.id FROM a JOIN b ON a.code = b.id"
+        self.assertEqual(self.run_sql(query), ["a.code,b.id", "2,2"])
+        # A larger inner table, so the join is costed differently.
+        self.run_sql("INSERT INTO b VALUES " + ", ".join(f"({i})" for i in range(3, 2000)))
+        self.assertEqual(self.run_sql(query), ["a.code,b.id", "2,2"])
+        self.assertEqual(self.run_sql("SELECT b.id, a.code FROM b JOIN a ON b.id = a.code"), ["b.id,a.code", "2,2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,23 @@
+import unittest
+from sql_parser import PlanCache
+
+
+class PlanCacheTest(unittest.TestCase):
+    def test_identifiers_differing_in_case_get_their_own_plans(self):
+        plans = PlanCache()
+        self.assertEqual(plans.get("SELECT key FROM k").columns, ["key"])
+        self.assertEqual(plans.get("SELECT KEY FROM k").columns, ["KEY"])
+
+    def test_bare_values_differing_in_case_get_their_own_plans(self):
+        plans = PlanCache()
+        self.assertEqual(plans.get("UPDATE t SET c = json WHERE id = 1").value, "json")
+        self.assertEqual(plans.get("UPDATE t SET c = JSON WHERE id = 1").value, "JSON")
+
+    def test_spacing_still_shares_a_plan(self):
+        plans = PlanCache()
+        plan = plans.get("SELECT a FROM t WHERE id = 1")
+        self.assertIs(plans.get("SELECT  a  FROM t WHERE id=1"), plan)
+
+
+if __name__ == "__main__":
+    unittest.main()
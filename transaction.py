@@ -1,145 +1,294 @@
-import os
-import threading
-import copy
+from itertools import islice
+from aggregate import aggregate_rows, compile_having
+from bulk_io import read_batches, write_rows
+from column_store import format_value
+from filter_engine import condition_text, filter_rows
+from join_executor import JoinSource, execute_join, output_columns, resolve_column
+from metrics import METRICS, plan_step
+from sorter import keyed, order_text, sort_keyed
+from workspace import TableWorkspace
+
+LOCK_TIMEOUT = 10
 
 class Transaction:
     def __init__(self, tm, tables, is_read_only):
         self.tm = tm
-        self.tables = sorted(tables)
+        self.tables = sorted(set(tables))
         self.is_read_only = is_read_only
+        self.logged = True
         self.locks = []
         self.data = {}
+        self.versions = {}
+        self.snapshots = {}
+
+        if is_read_only:
+            self.snapshots = tm.acquire_snapshots(self.tables)
+            for table, snapshot in self.snapshots.items():
+                self.versions[table] = snapshot.version
+                self.data[table] = TableWorkspace(table, snapshot.data, snapshot.indexes, snapshot.row_count,
+                                                  snapshot.tombstones)
+            return
 
-        for table in self.tables:
-            lock = tm.get_table_lock(table)
-            lock.acquire()
-            self.locks.append(lock)
+        try:
+            for table in self.tables:
+                self._lock_table(table)
+                self._load_table(table)
+        except Exception:
+            self._release_locks()
+            raise
+
+    def add_tables(self, tables):
+        # Session transactions lock tables as statements first touch them, so
+        # lock waits time out rather than deadlock against another session.
+        if self.is_read_only:
+            raise Exception("Cannot add tables to a read-only transaction")
+        for table in sorted(set(tables) - set(self.tables)):
+            self.tables.append(table)
+            self._lock_table(table)
             self._load_table(table)
 
+    def _lock_table(self, table):
+        lock = self.tm.get_table_lock(table)
+        with METRICS.timer("lock.wait"):
+            acquired = lock.acquire(timeout=LOCK_TIMEOUT)
+        if not acquired:
+            raise Exception(f"Timed out waiting for a lock on table '{table}'.")
+        self.locks.append(lock)
+
     def _load_table(self, table):
-        file_path = os.path.join("data", f"{table}.txt")
-        if not os.path.exists(file_path):
+        data, indexes, version, tombstones = self.tm.get_table_snapshot(table)
+        if data is None:
             return
-        with open(file_path, "r") as f:
-            lines = f.readlines()
-        columns = lines[0].strip().split(",")
-        data = {col: [] for col in columns}
-        for line in lines[1:]:
-            values = line.strip().split(",")
-            for i, col in enumerate(columns):
-                data[col].append(values[i] if i < len(values) else "")
-        if self.is_read_only:
-            self.tm.table_data[table] = data
-        else:
-            self.data[table] = copy.deepcopy(data)
+        self.versions[table] = version
+        self.data[table] = TableWorkspace(table, data, indexes, tombstones=tombstones)
 
     def insert_row(self, table, values):
         if self.is_read_only:
             raise Exception("Cannot write in read-only transaction")
-        table_data = self.data[table]
-        columns = list(table_data.keys())
-        if len(values) != len(columns):
+        ws = self.data[table]
+        if len(values) != len(ws.columns):
             raise ValueError("Value count doesn't match column count.")
-        meta = self.tm.get_table_metadata(table)
-        for idx, col in enumerate(columns):
-            val = values[idx]
-            if col == meta.primary_key or col in meta.unique_keys:
-                if val in table_data[col]:
-                    raise ValueError(f"Duplicate value '{val}' in column '{col}'")
-        for idx, col in enumerate(columns):
-            table_data[col].append(values[idx])
+        with plan_step("Insert", table) as op:
+            ws.insert(list(values))
+            op.rows = 1
+        METRICS.add("rows.inserted")
         print(f"Row inserted into '{table}'.")
 
-    def read_table(self, table, selected_columns=None, order_by=None, limit=None):
-        data = self.tm.table_data.get(table) if self.is_read_only else self.data.get(table)
-        if not data:
+    def insert_rows(self, table, rows):
+        if len(rows) == 1:
+            self.insert_row(table, rows[0])
+            return
+        if self.is_read_only:
+            raise Exception("Cannot write in read-only transaction")
+        ws = self.data[table]
+        if any(len(values) != len(ws.columns) for values in rows):
+            raise ValueError("Value count doesn't match column count.")
+        with plan_step("Insert", table) as op:
+            ws.insert_many(rows)
+            op.rows = len(rows)
+        METRICS.add("rows.inserted", len(rows))
+        print(f"Inserted {len(rows)} row(s) into '{table}'.")
+
+    def copy_from(self, table, path):
+        if self.is_read_only:
+            raise Exception("Cannot write in read-only transaction")
+        ws = self.data.get(table)
+        if not ws:
             print("Table does not exist.")
             return
-        headers = selected_columns if selected_columns else list(data.keys())
-        rows = list(zip(*[data[h] for h in headers]))
+        count = 0
+        with plan_step("Copy From", path) as op:
+            for batch in read_batches(path, ws.columns):
+                ws.insert_many(batch)
+                count += len(batch)
+            op.rows = count
+        METRICS.add("rows.inserted", count)
+        self.logged = False
+        print(f"Copied {count} row(s) into '{table}'.")
 
-        if order_by and order_by in data:
-            order_idx = headers.index(order_by) if selected_columns else list(data.keys()).index(order_by)
-            rows.sort(key=lambda x: x[order_idx])
+    def copy_to(self, table, path):
+        ws = self.data.get(table)
+        if not ws:
+            print("Table does not exist.")
+            return
+        with plan_step("Copy To", path) as op:
+            count = write_rows(path, ws.columns, ws.iter_rows(ws.columns))
+            op.rows = count
+        print(f"Copied {count} row(s) to '{path}'.")
 
-        if limit is not None:
-            rows = rows[:limit]
+    def read_table(self, table, selected_columns=None, order_by=None, limit=None, offset=0):
+        ws = self.data.get(table)
+        if not ws:
+            print("Table does not exist.")
+            return
+        headers = selected_columns if selected_columns else list(ws.columns)
+        if not self._check_columns(ws, headers, order_by):
+            return
 
-        print(",".join(headers))
-        for row in rows:
-            print(",".join(row))
+        if order_by:
+            rows = ws.iter_rows(headers, self._order_rids(ws, None, order_by, limit, offset))
+        else:
+            stop = None if limit is None else offset + limit
+            METRICS.add("rows.scanned", ws.row_count() if stop is None else min(stop, ws.row_count()))
+            rows = plan_step("Seq Scan", table).track(islice(ws.iter_rows(headers), offset, stop))
 
-    def read_table_with_condition(self, table, column, value, selected_columns=None, order_by=None, limit=None):
-        data = self.tm.table_data.get(table) if self.is_read_only else self.data.get(table)
-        if not data:
+        self._print_rows(headers, rows)
+
+    def read_table_with_condition(self, table, condition, selected_columns=None, order_by=None, limit=None,
+                                  offset=0):
+        ws = self.data.get(table)
+        if not ws:
             print("Table does not exist.")
             return
-        if column not in data:
-            print(f"WHERE column '{column}' does not exist.")
+
+        headers = selected_columns if selected_columns else list(ws.columns)
+        if not self._check_columns(ws, headers, order_by):
             return
 
-        headers = selected_columns if selected_columns else list(data.keys())
+        rids = filter_rows(ws, condition)
+
+        if order_by:
+            rids = self._order_rids(ws, rids, order_by, limit, offset)
+        else:
+            rids = rids[offset:None if limit is None else offset + limit]
+
+        self._print_rows(headers, ws.iter_rows(headers, rids))
+
+    def _check_columns(self, ws, headers, order_by):
         for h in headers:
-            if h not in data:
+            if h not in ws.columns:
                 print(f"Selected column '{h}' does not exist.")
-                return
-        if order_by and order_by not in data:
-            print(f"ORDER BY column '{order_by}' does not exist.")
-            return
+                return False
+        for column, _ in order_by or ():
+            if column not in ws.columns:
+                print(f"ORDER BY column '{column}' does not exist.")
+                return False
+        return True
 
-        matching_rows = []
-        for i in range(len(data[column])):
-            if data[column][i] == value:
-                matching_rows.append(tuple(data[h][i] for h in headers))
+    def _order_rids(self, ws, rids, order_by, limit, offset):
+        if rids is None:
+            if len(order_by) == 1 and limit is not None:
+                column, descending = order_by[0]
+                ordered = ws.ordered_rows(column, offset + limit, descending)
+                if ordered is not None:
+                    METRICS.add("rows.scanned", len(ordered))
+                    op = plan_step("Index Scan", f"{ws.table} ordered by {order_text(order_by)}")
+                    return op.track(ordered[offset:])
+            rids = ws.row_ids()
+            METRICS.add("rows.scanned", len(rids))
+            rids = plan_step("Seq Scan", ws.table).track(rids)
+        pairs, reverse = keyed(rids, [desc for _, desc in order_by],
+                               lambda batch: [ws.values(column, batch) for column, _ in order_by])
+        return sort_keyed(pairs, reverse, limit, offset, detail=order_text(order_by))
 
+    def read_aggregate(self, table, items, condition=None, group_by=(), aggregates=(), having=None,
+                       order_by=None, limit=None, offset=0):
+        ws = self.data.get(table)
+        if not ws:
+            print("Table does not exist.")
+            return
+        if items is None:
+            raise ValueError("SELECT * cannot be combined with GROUP BY or aggregates.")
+        for column in group_by:
+            if column not in ws.columns:
+                raise ValueError(f"GROUP BY column '{column}' does not exist.")
+        for item in items:
+            if isinstance(item, str) and item not in group_by:
+                raise ValueError(f"Column '{item}' must appear in GROUP BY or in an aggregate.")
+        labels = [item if isinstance(item, str) else item.label for item in items]
+        headers = [item if isinstance(item, str) else item.alias or item.label for item in items]
+        for column, _ in order_by or ():
+            if column not in group_by and column not in labels and column not in headers:
+                raise ValueError(f"ORDER BY column '{column}' must be a GROUP BY column or an aggregate.")
 
+        results = []
+        for key, values in aggregate_rows(ws, condition, group_by, aggregates):
+            row = dict(zip(group_by, key))
+            for agg, value in zip(aggregates, values):
+                row[agg.label] = value
+                if agg.alias:
+                    row[agg.alias] = value
+            results.append(row)
+        if having:
+            test = compile_having(having, ws, group_by, aggregates)
+            with plan_step("Having", condition_text(having)) as op:
+                results = [row for row in results if test.matches(row, None)]
+                op.rows = len(results)
         if order_by:
-            order_idx = headers.index(order_by)
-            matching_rows.sort(key=lambda x: x[order_idx])
+            pairs, reverse = keyed(results, [desc for _, desc in order_by],
+                                   lambda batch: [[row[column] for row in batch] for column, _ in order_by])
+            results = sort_keyed(pairs, reverse, limit, offset, detail=order_text(order_by))
+        else:
+            results = islice(results, offset, None if limit is None else offset + limit)
+        self._print_rows(headers, (tuple(row[label] for label in labels) for row in results))
 
-        if limit is not None:
-            matching_rows = matching_rows[:limit]
+    def read_join(self, tables, joins, condition=None, selected_columns=None, order_by=None, limit=None,
+                  offset=0):
+        sources = []
+        for table, alias in tables:
+            ws = self.data.get(table)
+            if not ws:
+                print(f"Table '{table}' does not exist.")
+                return
+            sources.append(JoinSource(alias, ws))
+        headers, columns = output_columns(sources, selected_columns)
+        rows = execute_join(sources, joins, condition)
+        if order_by:
+            keys = [resolve_column(sources, column) for column, _ in order_by]
+            pairs, reverse = keyed(rows, [desc for _, desc in order_by],
+                                   lambda batch: [[sources[pos].ws.get(column, row[pos]) for row in batch]
+                                                  for pos, column in keys])
+            rows = sort_keyed(pairs, reverse, limit, offset, detail=order_text(order_by))
+        else:
+            rows = islice(rows, offset, None if limit is None else offset + limit)
+        self._print_rows(headers, (tuple(sources[pos].ws.get(col, row[pos]) for pos, col in columns)
+                                   for row in rows))
 
+    def _print_rows(self, headers, rows):
         print(",".join(headers))
-        for row in matching_rows:
-            print(",".join(row))
+        for row in plan_step("Output", ", ".join(headers)).track(rows):
+            print(",".join(format_value(v) for v in row))
 
-    def update_rows(self, table, set_col, new_val, where_col, where_val):
+    def update_rows(self, table, set_col, new_val, condition):
         if self.is_read_only:
             raise Exception("Cannot write in read-only transaction")
-        data = self.data[table]
-        count = 0
-        for i in range(len(data[where_col])):
-            if data[where_col][i] == where_val:
-                data[set_col][i] = new_val
-                count += 1
-        print(f"Updated {count} row(s).")
+        ws = self.data[table]
+        if set_col not in ws.columns:
+            raise ValueError(f"Column '{set_col}' does not exist.")
+        rids = filter_rows(ws, condition)
+        with plan_step("Update", f"{table} set {set_col}") as op:
+            ws.update(rids, set_col, new_val)
+            op.rows = len(rids)
+        METRICS.add("rows.updated", len(rids))
+        print(f"Updated {len(rids)} row(s).")
 
-    def delete_rows(self, table, column, value):
+    def delete_rows(self, table, condition):
         if self.is_read_only:
             raise Exception("Cannot write in read-only transaction")
-        data = self.data[table]
-        indices = [i for i, val in enumerate(data[column]) if val == value]
-        for col in data:
-            for i in reversed(indices):
-                del data[col][i]
-        print(f"Deleted {len(indices)} row(s).")
+        ws = self.data[table]
+        rids = filter_rows(ws, condition)
+        with plan_step("Delete", table) as op:
+            ws.delete(rids)
+            op.rows = len(rids)
+        METRICS.add("rows.deleted", len(rids))
+        print(f"Deleted {len(rids)} row(s).")
 
     def commit(self):
-        if not self.is_read_only:
-            for table in self.tables:
-                file_path = os.path.join("data", f"{table}.txt")
-                data = self.data[table]
-                with open(file_path, "w") as f:
-                    headers = list(data.keys())
-                    f.write(",".join(headers) + "\n")
-                    for i in range(len(data[headers[0]])):
-                        row = ",".join(data[h][i] for h in headers)
-                        f.write(row + "\n")
-                self.tm.table_data[table] = data
+        try:
+            if not self.is_read_only:
+                with METRICS.timer("commit"), plan_step("Commit", ", ".join(self.tables)):
+                    self.tm.commit_tables(self.data.values(), self.logged)
+        finally:
+            self._release_locks()
+
+    def rollback(self):
+        self.data.clear()
         self._release_locks()
 
     def _release_locks(self):
+        for snapshot in self.snapshots.values():
+            self.tm.release_snapshot(snapshot)
+        self.snapshots.clear()
         for lock in self.locks:
             lock.release()
         self.locks.clear()
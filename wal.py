@@ -0,0 +1,103 @@
+import json
+import os
+import shutil
+from metrics import METRICS
+
+
+def apply_operation(data, op, tombstones):
+    # Deleted rows are collected in tombstones, to be compacted after replay.
+    kind = op["op"]
+    if kind == "insert":
+        for row in op["rows"]:
+            for col, val in zip(data.keys(), row):
+                data[col].append(val)
+    elif kind == "update":
+        column = data[op["column"]]
+        for i in op["rows"]:
+            column[i] = op["value"]
+    elif kind == "tombstone":
+        tombstones.update(op["rows"])
+    elif kind == "delete":
+        # Logs written before deletes became tombstones.
+        rows = set(op["rows"])
+        for col in data:
+            data[col] = data[col].without(rows)
+    else:
+        raise ValueError(f"Unknown log operation '{kind}'.")
+
+
+class WriteAheadLog:
+    def __init__(self, path):
+        self.path = path
+        self.last_lsn = 0
+        self.file = None
+        # (lsn, byte offset) of each record in the file, so truncate can keep
+        # the tail a checkpoint did not cover without parsing the log.
+        self.offsets = []
+
+    def replay(self):
+        records = []
+        self.offsets = []
+        if not os.path.exists(self.path):
+            return records
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self.last_lsn = max(self.last_lsn, record["lsn"])
+                if record["ops"]:
+                    records.append(record)
+                    self.offsets.append((record["lsn"], offset))
+                offset += len(line)
+        return records
+
+    def open(self):
+        self.file = open(self.path, "ab")
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def append(self, ops):
+        self.last_lsn += 1
+        record = (json.dumps({"lsn": self.last_lsn, "ops": ops}, separators=(",", ":")) + "\n").encode("utf-8")
+        with METRICS.timer("wal.append"):
+            self.offsets.append((self.last_lsn, self.file.tell()))
+            self.file.write(record)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        METRICS.add("wal.bytes_written", len(record))
+        return self.last_lsn
+
+    def size(self):
+        return self.file.tell() if self.file else 0
+
+    def truncate(self, keep_from=None):
+        # Drops every record before LSN keep_from (all of them by default).
+        # The first line carries the last LSN, so numbering goes on from it.
+        tmp_path = self.path + ".tmp"
+        header = (json.dumps({"lsn": self.last_lsn, "ops": []}) + "\n").encode("utf-8")
+        start = None
+        if keep_from is not None:
+            start = next((offset for lsn, offset in self.offsets if lsn >= keep_from), None)
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            if start is not None:
+                with open(self.path, "rb") as log:
+                    log.seek(start)
+                    shutil.copyfileobj(log, f)
+            f.flush()
+            os.fsync(f.fileno())
+        if start is None:
+            self.offsets = []
+        else:
+            self.offsets = [(lsn, offset - start + len(header)) for lsn, offset in self.offsets if offset >= start]
+        self.close()
+        os.replace(tmp_path, self.path)
+        self.open()
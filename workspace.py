@@ -0,0 +1,282 @@
+import operator
+from itertools import islice
+from operator import itemgetter
+from column_store import make_column
+
+COMPARISONS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def take(values, positions):
+    if not positions:
+        return []
+    if len(positions) == 1:
+        return [values[positions[0]]]
+    return list(itemgetter(*positions)(values))
+
+
+class TableWorkspace:
+    def __init__(self, table, base, indexes, row_count=None, tombstones=frozenset()):
+        self.table = table
+        self.base = base
+        self.base_indexes = indexes
+        self.indexes = indexes.overlay()
+        self.columns = list(base.keys())
+        if row_count is None:
+            row_count = len(base[self.columns[0]]) if self.columns else 0
+        self.base_rows = row_count
+        # Inserted rows are kept in typed column buffers, not lists of boxed
+        # values, until the commit appends them to the table.
+        self.inserted = {col: make_column(base[col].type) for col in self.columns}
+        self.updated = {}
+        self.deleted = set()
+        # Rows deleted by earlier commits: they keep their row ids, and are
+        # out of the indexes, until a checkpoint compacts the table.
+        self.tombstones = tombstones
+
+    def has_changes(self):
+        return bool(self.updated or self.deleted or self.inserted_count())
+
+    def inserted_count(self):
+        return len(self.inserted[self.columns[0]]) if self.columns else 0
+
+    def row_count(self):
+        return self.base_rows + self.inserted_count() - len(self.deleted) - len(self.tombstones)
+
+    def row_ids(self):
+        total = self.base_rows + self.inserted_count()
+        if not self.deleted and not self.tombstones:
+            return range(total)
+        return [rid for rid in range(total) if rid not in self.deleted and rid not in self.tombstones]
+
+    def get(self, column, rid):
+        if rid >= self.base_rows:
+            return self.inserted[column][rid - self.base_rows]
+        row = self.updated.get(rid)
+        if row is not None and column in row:
+            return row[column]
+        return self.base[column][rid]
+
+    def scan(self, column):
+        if not self.updated and not self.deleted:
+            rows = islice(enumerate(self.base[column]), self.base_rows)
+            if self.tombstones:
+                rows = ((rid, val) for rid, val in rows if rid not in self.tombstones)
+            yield from rows
+            start = self.base_rows
+            for offset, val in enumerate(self.inserted[column]):
+                yield start + offset, val
+            return
+        for rid in self.row_ids():
+            yield rid, self.get(column, rid)
+
+    def iter_rows(self, headers, rids=None):
+        if rids is None and not self.has_changes():
+            rows = islice(zip(*[self.base[h] for h in headers]), self.base_rows)
+            if self.tombstones:
+                rows = (row for rid, row in enumerate(rows) if rid not in self.tombstones)
+            return rows
+        if rids is None:
+            rids = self.row_ids()
+        return (tuple(self.get(h, rid) for h in headers) for rid in rids)
+
+    def values(self, column, rids):
+        # Values of one column for a batch of row ids, gathered from the column
+        # buffer in one call when the batch only touches base rows.
+        if self.updated or (rids and max(rids) >= self.base_rows):
+            return [self.get(column, rid) for rid in rids]
+        base = self.base[column]
+        if base.type == "TEXT":
+            return list(map(base.dictionary.__getitem__, take(base.codes, rids)))
+        values = take(base.values, rids)
+        return list(map(bool, values)) if base.type == "BOOL" else values
+
+    def convert(self, column, value):
+        return self.base[column].convert(value)
+
+    def find_rows(self, column, value):
+        value = self.convert(column, value)
+        index = self.indexes.get(column)
+        if index is not None:
+            rid = index.lookup(value)
+            return [rid] if rid is not None and rid < self.base_rows + self.inserted_count() else []
+        if self.indexes.get_sorted(column) is not None:
+            return self._find_with_sorted(column, value, value, True, True, operator.eq, value)
+        if not self.updated and not self.deleted:
+            rids = self.base[column].find_equal(value, self.base_rows)
+            if self.tombstones:
+                rids = [rid for rid in rids if rid not in self.tombstones]
+            start = self.base_rows
+            rids.extend(start + i for i, val in enumerate(self.inserted[column]) if val == value)
+            return rids
+        return [rid for rid, val in self.scan(column) if val == value]
+
+    def find_compare(self, column, op, value):
+        if op == "=":
+            return self.find_rows(column, value)
+        value = self.convert(column, value)
+        compare = COMPARISONS[op]
+        if op != "!=" and self.indexes.get_sorted(column) is not None:
+            low = value if op in (">", ">=") else None
+            high = value if op in ("<", "<=") else None
+            return self._find_with_sorted(column, low, high, op != ">", op != "<", compare, value)
+        return [rid for rid, val in self.scan(column) if compare(val, value)]
+
+    def _find_with_sorted(self, column, low, high, low_inclusive, high_inclusive, compare, value):
+        index = self.indexes.get_sorted(column)
+        changed = self.updated or self.deleted
+        rids = [rid for rid in index.range(low, high, low_inclusive, high_inclusive)
+                if rid < self.base_rows and not (changed and self._changed(rid, column))]
+        for rid, row in self.updated.items():
+            if column in row and rid not in self.deleted and compare(row[column], value):
+                rids.append(rid)
+        start = self.base_rows
+        for offset, val in enumerate(self.inserted[column]):
+            if start + offset not in self.deleted and compare(val, value):
+                rids.append(start + offset)
+        rids.sort()
+        return rids
+
+    def _changed(self, rid, column):
+        return rid in self.deleted or column in self.updated.get(rid, ())
+
+    def ordered_rows(self, column, limit, reverse=False):
+        index = self.indexes.get_sorted(column)
+        if index is None or self.has_changes():
+            return None
+        return list(islice((rid for rid in index.range(reverse=reverse) if rid < self.base_rows), limit))
+
+    def sort_rows(self, rids, column, reverse=False):
+        if not self.updated and not any(rid >= self.base_rows for rid in rids):
+            return self.base[column].sort_positions(rids, reverse)
+        return sorted(rids, key=lambda rid: self.get(column, rid), reverse=reverse)
+
+    def insert(self, values):
+        values = [self.convert(col, val) for col, val in zip(self.columns, values)]
+        for col, val in zip(self.columns, values):
+            self.indexes.check_unique(col, val)
+        rid = self.base_rows + self.inserted_count()
+        for col, val in zip(self.columns, values):
+            self.inserted[col].append(val)
+            index = self.indexes.get(col)
+            if index is not None:
+                index.add(val, rid)
+        return rid
+
+    def insert_many(self, rows):
+        # Bulk insert: values are converted and unique columns checked a
+        # column at a time for the whole batch before anything is appended.
+        start = self.base_rows + self.inserted_count()
+        columns = [list(map(self.base[col].convert, values)) for col, values in zip(self.columns, zip(*rows))]
+        for col, values in zip(self.columns, columns):
+            if self.indexes.get(col) is None:
+                continue
+            seen = set()
+            for val in values:
+                if val in seen:
+                    raise ValueError(f"Duplicate value '{val}' in column '{col}'")
+                seen.add(val)
+                self.indexes.check_unique(col, val)
+        for col, values in zip(self.columns, columns):
+            index = self.indexes.get(col)
+            if index is not None:
+                for rid, val in enumerate(values, start):
+                    index.add(val, rid)
+            self.inserted[col].extend(values)
+
+    def update(self, rids, column, value):
+        value = self.convert(column, value)
+        index = self.indexes.get(column)
+        if index is not None and rids:
+            if len(rids) > 1:
+                raise ValueError(f"Duplicate value '{value}' in column '{column}'")
+            self.indexes.check_unique(column, value, rids[0])
+        for rid in rids:
+            if index is not None:
+                index.remove(self.get(column, rid))
+                index.add(value, rid)
+            if rid >= self.base_rows:
+                self.inserted[column][rid - self.base_rows] = value
+            else:
+                self.updated.setdefault(rid, {})[column] = value
+
+    def delete(self, rids):
+        for rid in rids:
+            for index in self.indexes.indexes.values():
+                index.remove(self.get(index.column, rid))
+            self.deleted.add(rid)
+
+    def to_ops(self):
+        ops = []
+        groups = {}
+        for rid, row in self.updated.items():
+            if rid in self.deleted:
+                continue
+            for col, val in row.items():
+                groups.setdefault((col, val), []).append(rid)
+        for (col, val), rids in groups.items():
+            ops.append({"table": self.table, "op": "update", "column": col, "value": val, "rows": sorted(rids)})
+        # Inserted rows are logged even if this transaction deleted them, so
+        # row ids on replay match the ones the tombstones name.
+        if self.columns and self.inserted[self.columns[0]]:
+            rows = [list(row) for row in zip(*[self.inserted[col] for col in self.columns])]
+            ops.append({"table": self.table, "op": "insert", "rows": rows})
+        if self.deleted:
+            ops.append({"table": self.table, "op": "tombstone", "rows": sorted(self.deleted)})
+        return ops
+
+    def merge(self, shared=False):
+        # Snapshot readers bound their scans by row count, so appends are safe
+        # in place; updated columns and the hash indexes deletes take keys out
+        # of get fresh copies while shared. Deleted rows only become
+        # tombstones, so nothing is rewritten for them.
+        copy_on_write = shared and bool(self.updated or self.deleted)
+        sorted_changes = self._sorted_changes()
+        base = dict(self.base) if copy_on_write else self.base
+        updated_cols = {col for row in self.updated.values() for col in row}
+        if copy_on_write:
+            for col in updated_cols:
+                base[col] = base[col].copy()
+        for rid, row in self.updated.items():
+            if rid in self.deleted:
+                continue
+            for col, val in row.items():
+                base[col][rid] = val
+        for col in self.columns:
+            base[col].extend(self.inserted[col])
+        if copy_on_write:
+            indexes = self.base_indexes.copy_columns(set(self.base_indexes.indexes) if self.deleted else updated_cols)
+            self.indexes.merge(indexes)
+        else:
+            indexes = self.base_indexes
+            self.indexes.merge()
+        indexes = indexes.apply_sorted_changes(*sorted_changes, shared)
+        return base, indexes, self.tombstones | self.deleted if self.deleted else self.tombstones
+
+    def _sorted_changes(self):
+        sorted_cols = {index.column for index in self.base_indexes.sorted.values()}
+        removed = []
+        added = []
+        if not sorted_cols:
+            return removed, added
+        for rid, row in self.updated.items():
+            for col, val in row.items():
+                if col in sorted_cols:
+                    removed.append((col, self.base[col][rid], rid))
+                    if rid not in self.deleted:
+                        added.append((col, val, rid))
+        for rid in self.deleted:
+            if rid < self.base_rows:
+                for col in sorted_cols - set(self.updated.get(rid, ())):
+                    removed.append((col, self.base[col][rid], rid))
+        for col in sorted_cols:
+            for offset, val in enumerate(self.inserted[col]):
+                if self.base_rows + offset not in self.deleted:
+                    added.append((col, val, self.base_rows + offset))
+        return removed, added